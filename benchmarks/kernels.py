@@ -0,0 +1,212 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# Micro-benchmarks of the numerical kernels: the circuit models, the weights
+# of the CAPD detector, the sampling, processing and certification of cells.
+#
+# Each kernel is timed (the best and the median of several repetitions) and
+# its peak memory is traced (tracemalloc, in a separate run). The results are
+# compared against the baseline stored in baseline.json, the script fails
+# whenever a kernel regresses beyond the threshold. Runs without MPI.
+#
+#   python benchmarks/kernels.py                    # compare with baseline
+#   python benchmarks/kernels.py --save             # record a new baseline
+#   python benchmarks/kernels.py --filter sampler   # only matching kernels
+#
+# The baseline is only meaningful on the machine it was recorded on.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import numpy as np
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_ROOT), 'unified'))
+
+import unified
+import circuit
+
+from stellar import threshold_curve
+from certify import threshold_curve_certify
+from certify import threshold_curve_certify_vectorized
+
+BENCH_BASELINE = os.path.join(BENCH_ROOT, 'baseline.json')
+BENCH_THRESHOLD = 0.25
+
+def make_rspace (size):
+    return np.linspace(unified.DEF_SAMPLE_R_BEG, unified.DEF_SAMPLE_R_END, size)
+
+def make_cell (size, runs, m = 4):
+    # A sampled cell well within the feasible region.
+    Rv = make_rspace(size)
+    Ps, Pn = circuit.evaluate_circuit_pnrd_pnrd(Rv, 0.95, 0.95, m, d = 20)
+    Cs, Fn = unified.cell_sampler(Ps, Pn, runs = runs)
+    return Rv, Ps, Cs, Fn
+
+# Benchmarked kernels. Each entry prepares its inputs and returns the
+# callable to be timed.
+#
+
+def bench_circuit_fast (size, d):
+    Rv = make_rspace(size)
+    return lambda: circuit.evaluate_circuit_fast(Rv, 0.9, 0.9, 4, d)
+
+def bench_circuit_stacked (size, d, count):
+    Rv = make_rspace(size)
+    return lambda: circuit.evaluate_circuit_fast(Rv, 0.9, 0.9, np.arange(count), d)
+
+def bench_circuit_tail (size, n):
+    Rv = make_rspace(size)
+    return lambda: circuit.evaluate_circuit_pnrd_pnrd(Rv, 0.9, 0.9, 4, n, tail = True)
+
+def bench_capd_pnrd (size, K, M):
+    Rv = make_rspace(size)
+    return lambda: circuit.evaluate_circuit_capd_pnrd(Rv, 0.9, 0.9, 4, M, K = K, d = 20)
+
+def bench_capd_pnrd_workspace (size, K, M):
+    # Steady state of a worker, the workspace and the output are reused.
+    Rv = make_rspace(size)
+    W = circuit.CircuitWorkspace(Rv)
+    out = W.buffer('result', 20)
+    return lambda: circuit.evaluate_circuit_capd_pnrd(Rv, 0.9, 0.9, 4, M, K = K, d = 20,
+        out = out, workspace = W)
+
+def bench_capd_weights (K, M):
+    jv = np.arange(K)
+    return lambda: circuit._detector_capd_weights(4, M, jv)
+
+def bench_cell_sampler (size, runs, precision = 'double'):
+    Rv = make_rspace(size)
+    Ps, Pn = circuit.evaluate_circuit_pnrd_pnrd(Rv, 0.9, 0.9, 4, d = 20)
+    return lambda: unified.cell_sampler(Ps, Pn, runs = runs, precision = precision)
+
+def bench_cell_process (size, runs):
+    Rv, Ps, Cs, Fn = make_cell(size, runs)
+    return lambda: unified.cell_process(Rv, Ps, Cs, Fn, 4,
+        unified.DEF_CERTIFY_CRITERIA)
+
+def bench_certify (level):
+    curve = threshold_curve(level)
+    return lambda: threshold_curve_certify(curve,
+        0.02, 0.002, 3.0, 0.25, 0.01, 3.0)
+
+def bench_certify_vectorized (level, size):
+    curve = threshold_curve(level)
+    rng = np.random.default_rng(1)
+    x_avg, y_avg = rng.uniform(0.0, 0.1, size), rng.uniform(0.0, 0.5, size)
+    x_std, y_std = 0.1 * x_avg, 0.1 * y_avg
+    return lambda: threshold_curve_certify_vectorized(curve,
+        x_avg, x_std, 3.0, y_avg, y_std, 3.0)
+
+BENCH_KERNELS = {
+    'circuit_fast[R=100,d=20]' : (bench_circuit_fast, (100, 20)),
+    'circuit_fast[R=1000,d=20]' : (bench_circuit_fast, (1000, 20)),
+    'circuit_fast[R=1000,d=40]' : (bench_circuit_fast, (1000, 40)),
+    'circuit_stacked[R=1000,d=6,T=100]' : (bench_circuit_stacked, (1000, 6, 100)),
+    'circuit_tail[R=1000,n=5]' : (bench_circuit_tail, (1000, 5)),
+    'capd_pnrd[R=100,K=50,M=10]' : (bench_capd_pnrd, (100, 50, 10)),
+    'capd_pnrd[R=100,K=100,M=10]' : (bench_capd_pnrd, (100, 100, 10)),
+    'capd_pnrd[R=100,K=100,M=20]' : (bench_capd_pnrd, (100, 100, 20)),
+    'capd_workspace[R=100,K=100,M=10]' : (bench_capd_pnrd_workspace, (100, 100, 10)),
+    'capd_workspace[R=1000,K=100,M=10]' : (bench_capd_pnrd_workspace, (1000, 100, 10)),
+    'capd_weights[K=100,M=10]' : (bench_capd_weights, (100, 10)),
+    'capd_weights[K=100,M=20]' : (bench_capd_weights, (100, 20)),
+    'cell_sampler[R=100,runs=1000]' : (bench_cell_sampler, (100, 1000)),
+    'cell_sampler[R=100,runs=1000,single]' : (bench_cell_sampler, (100, 1000, 'single')),
+    'cell_process[R=100,runs=1000]' : (bench_cell_process, (100, 1000)),
+    'certify[L=4]' : (bench_certify, (4, )),
+    'certify_vectorized[L=4,N=1000]' : (bench_certify_vectorized, (4, 1000)),
+}
+
+# Measurements.
+#
+
+def measure (kernel, repeat):
+    for _ in range(max(1, repeat // 2)):
+        kernel()
+
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        kernel()
+        times.append(time.perf_counter() - tic)
+
+    tracemalloc.start()
+    kernel()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'time' : min(times),
+        'median' : float(np.median(times)),
+        'peak' : peak }
+
+def compare (results, baseline, threshold):
+    '''
+    Returns the list of regressions, kernels whose time or peak memory
+    exceeds the baseline by more than the threshold (a fraction).
+    '''
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in [ 'time', 'peak' ]:
+            ratio = result[key] / max(baseline[name][key], 1e-12)
+            if ratio > 1.0 + threshold:
+                regressions.append((name, key, ratio))
+    return regressions
+
+def main ():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmarks the numerical kernels.')
+    parser.add_argument('--baseline', default = BENCH_BASELINE)
+    parser.add_argument('--threshold', type = float, default = BENCH_THRESHOLD,
+        help = 'tolerated slowdown, a fraction of the baseline')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--filter', default = '',
+        help = 'only run kernels whose name contains this text')
+    parser.add_argument('--save', action = 'store_true',
+        help = 'store the results as the new baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)['kernels']
+
+    results = {}
+    print(f'{"kernel":36} {"time [ms]":>10} {"median":>10} {"peak [MB]":>10} {"ratio":>7}')
+    for name, (bench, bench_args) in BENCH_KERNELS.items():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(bench(* bench_args), args.repeat)
+        ratio = f'{result["time"] / baseline[name]["time"]:7.2f}' \
+            if name in baseline else f'{"-":>7}'
+        print(f'{name:36} {1e3 * result["time"]:10.3f} '
+            f'{1e3 * result["median"]:10.3f} {result["peak"] / 2 ** 20:10.3f} {ratio}')
+
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump({
+                'machine' : {
+                    'platform' : platform.platform(),
+                    'processor' : platform.processor(),
+                    'python' : platform.python_version(),
+                    'numpy' : np.__version__ },
+                'kernels' : { ** baseline, ** results }
+            }, file, indent = 2)
+        print(f'Baseline stored in {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, key, ratio in regressions:
+        print(f'Regression: {name} {key} is {ratio:.2f} times the baseline')
+    return 1 if regressions else 0
+
+if (__name__ == '__main__'):
+    sys.exit(main())
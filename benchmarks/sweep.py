@@ -0,0 +1,183 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# End-to-end benchmark of the unified pipeline. Runs all the PNRD and CAPD
+# targets on a reduced grid through a local (or serial) pool, without MPI,
+# and reports the wall time, the throughput in cells per second, the time
+# spent in the stages of the workers, the peak resident memory of the tasks
+# and of the whole run.
+#
+# The results are checked against the reference of the circuit mode stored
+# in sweep.reference.<mode>.pickle.zstd. The sampling is random (seeded, see
+# unified.DEF_SAMPLE_SEED, a rerun with the same seed gives the same results),
+# the results are only compared up to a tolerance: the certified cells must
+# coincide and the optimal squeezing rates of most of them must lie within
+# a grid step.
+#
+#   python benchmarks/sweep.py                      # compare with reference
+#   python benchmarks/sweep.py --save-reference     # record a new reference
+#   python benchmarks/sweep.py --executor local --workers 4
+#   python benchmarks/sweep.py --executor local --workers 2 --threads 2
+#   python benchmarks/sweep.py --r-num 1000 --runs 1000 --memory 64
+#   python benchmarks/sweep.py --precision single   # validate single precision
+#   python benchmarks/sweep.py --mode tail
+
+import os
+import sys
+import json
+import argparse
+import resource
+import tempfile
+
+import numpy as np
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_ROOT), 'unified'))
+
+import unified
+
+from helpers import Stopwatch, zstd_pickle_dump, zstd_pickle_load
+
+BENCH_REFERENCE = os.path.join(BENCH_ROOT, 'sweep.reference.{mode}.pickle.zstd')
+
+def configure (args, result_path):
+    # The reduced sweep, everything else is left as configured.
+    unified.DEF_RESULT_CACHE = None
+    unified.DEF_EXECUTOR = args.executor
+    unified.DEF_EXECUTOR_WORKERS = args.workers
+    return unified.Sweep('benchmark',
+        sample_z_num = args.z_num,
+        sample_r_num = args.r_num,
+        experiment_runs = args.runs,
+        circuit_mode = args.mode,
+        sample_precision = args.precision,
+        sample_seed = args.seed,
+        sample_generator = args.generator,
+        sample_threads = args.threads,
+        task_memory = None if args.memory is None else int(args.memory * 2 ** 20),
+        result_format = 'pickle',
+        result_path = result_path)
+
+def collect (result_path):
+    '''
+    Gathers the results of the targets and the timing reports of the
+    dispatched targets (a single one when the targets of a cell are shared,
+    see unified.DEF_CIRCUIT_PLAN).
+    '''
+
+    results, reports = {}, {}
+    for name in sorted(os.listdir(result_path)):
+        if name.endswith('.timing.json'):
+            with open(os.path.join(result_path, name)) as file:
+                reports[name[:-len('.timing.json')]] = json.load(file)
+        elif name.endswith('.pickle.zstd') and name.count('.') == 2 \
+            and name.startswith(('pnrd_pnrd_', 'capd_pnrd_')):
+            results[name[:-len('.pickle.zstd')]] = zstd_pickle_load(
+                os.path.join(result_path, name))
+    return results, reports
+
+def compare (results, reference, r_tol, fraction):
+    '''
+    Compares the results with the reference, returns the list of failures.
+    The cells certified in the reference (finite success rate) must be
+    certified in the results and vice versa, save for 3% of them; the
+    optimal squeezing rates of the fraction of the certified cells must
+    agree up to the absolute tolerance r_tol.
+    '''
+
+    failures = []
+    for target, expected in reference.items():
+        if target not in results:
+            failures.append(f'{target}: missing')
+            continue
+        actual = results[target]
+        if actual.shape != expected.shape:
+            failures.append(f'{target}: shape {actual.shape} != {expected.shape}')
+            continue
+
+        actual_ok = np.isfinite(actual[..., 0])
+        expected_ok = np.isfinite(expected[..., 0])
+        agree = np.mean(actual_ok == expected_ok)
+        if agree < 0.97:
+            failures.append(f'{target}: {agree:.1%} cells agree on certification')
+
+        both = actual_ok & expected_ok
+        if np.any(both):
+            # (@) A single cell is tolerated for targets with few certified cells.
+            close = np.abs(actual[both, 1] - expected[both, 1]) <= r_tol
+            if np.sum(~ close) > max(1, (1 - fraction) * close.size):
+                failures.append(f'{target}: {np.mean(close):.1%} squeezing rates agree')
+    return failures
+
+def report_stages (reports):
+    stages, busy = {}, 0.0
+    for report in reports.values():
+        busy += report['busy']
+        for path, entry in report['stages'].items():
+            stages[path] = stages.get(path, 0.0) + entry['total']
+    for path, total in sorted(stages.items()):
+        print(f'  {path:30} {total:10.3f} s {total / busy:7.1%}')
+    memory = max(report['memory'] for report in reports.values())
+    print(f'  peak task memory {memory / 2 ** 20:.1f} MB')
+
+def main ():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmarks the unified pipeline on a reduced grid.')
+    parser.add_argument('--z-num', type = int, default = 11)
+    parser.add_argument('--r-num', type = int, default = 100)
+    parser.add_argument('--runs', type = int, default = 100)
+    parser.add_argument('--mode', default = unified.DEF_CIRCUIT_MODE,
+        choices = [ 'full', 'tail', 'adaptive' ],
+        help = 'circuit mode, see unified.DEF_CIRCUIT_MODE')
+    parser.add_argument('--precision', default = unified.DEF_SAMPLE_PRECISION,
+        choices = [ 'double', 'single' ],
+        help = 'precision of the sampling, see unified.DEF_SAMPLE_PRECISION')
+    parser.add_argument('--seed', type = int, default = unified.DEF_SAMPLE_SEED)
+    parser.add_argument('--generator', default = unified.DEF_SAMPLE_GENERATOR,
+        help = 'bit generator of the sampling, see unified.DEF_SAMPLE_GENERATOR')
+    parser.add_argument('--executor', default = 'serial',
+        choices = [ 'serial', 'local' ])
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--threads', type = int, default = unified.DEF_SAMPLE_THREADS,
+        help = 'sampling threads of each worker, see unified.DEF_SAMPLE_THREADS')
+    parser.add_argument('--memory', type = float, default = None,
+        help = 'memory budget of the sampling in MB, see unified.DEF_TASK_MEMORY')
+    parser.add_argument('--reference', default = None,
+        help = 'reference of the circuit mode by default')
+    parser.add_argument('--r-steps', type = float, default = 1.0,
+        help = 'tolerated difference of the optimal rates, in grid steps')
+    parser.add_argument('--fraction', type = float, default = 0.9)
+    parser.add_argument('--save-reference', action = 'store_true')
+    args = parser.parse_args()
+    args.reference = args.reference or BENCH_REFERENCE.format(mode = args.mode)
+
+    with tempfile.TemporaryDirectory() as result_path:
+        sweep = configure(args, result_path)
+        with (runtime := Stopwatch()):
+            unified.master([ sweep ])
+        results, reports = collect(result_path)
+
+    cells = sum(result.shape[0] * result.shape[1] for result in results.values())
+    # (@) The peak of a serial run is reset by its tasks, see helpers.peak_memory.
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        max(report['memory'] for report in reports.values()) // 1024)
+
+    print(f'{len(results)} targets, {cells} cells in {runtime():.3f} s, '
+        f'{cells / runtime():.2f} cells/s, peak RSS {peak_rss / 1024:.1f} MB')
+    report_stages(reports)
+
+    if args.save_reference:
+        zstd_pickle_dump(args.reference, results)
+        print(f'Reference stored in {args.reference}')
+        return 0
+
+    r_step = (sweep.sample_r_end - sweep.sample_r_beg) / (args.r_num - 1)
+    failures = compare(results, zstd_pickle_load(args.reference),
+        r_tol = 1.01 * args.r_steps * r_step, fraction = args.fraction)
+    for failure in failures:
+        print(f'Mismatch: {failure}')
+    return 1 if failures else 0
+
+if (__name__ == '__main__'):
+    sys.exit(main())
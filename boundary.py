@@ -0,0 +1,143 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module extracts the feasibility frontier (boundary) from the datasets.
+# Please refer to the documentation strings of the functions for details.
+#
+# For each heralding transmission rate (zeta1), the boundary is given by the
+# least characterization transmission rate (zeta2) that still allows for the
+# preparation of a certifiable state. The jagged boundary is smoothened by a
+# spline. The splines of all the targets of a dataset are extracted in one
+# batched pass and evaluated in bulk.
+
+import os
+import numpy as np
+import scipy.interpolate as si
+
+from helpers import zstd_pickle_load, zstd_pickle_dump
+from tilestore import TILESTORE_SUFFIX
+
+BOUNDARY_CACHE = 'boundary.pickle.zstd'
+
+class BoundaryCurves:
+    '''
+    Smoothened boundaries of several targets.
+
+    Calling the instance with an array X of heralding transmission rates
+    returns an array of shape (T, X.size) with the corresponding boundary
+    rates of the T targets. Outside the domain of the respective boundary
+    the values are NaN.
+    '''
+
+    def __init__ (self, tck_list, domain_list):
+        self.tck_list = list(tck_list)
+        self.domain_list = list(domain_list)
+
+    def __len__ (self):
+        return len(self.tck_list)
+
+    def __iter__ (self):
+        return (self[index] for index in range(len(self)))
+
+    def __getitem__ (self, index):
+        return BoundaryCurves(self.tck_list[index:index + 1],
+            self.domain_list[index:index + 1])
+
+    def __call__ (self, X):
+        X = np.asarray(X, dtype = np.float64)
+        Y = np.full((len(self), * X.shape), np.nan)
+        for index, (tck, domain) in enumerate(zip(self.tck_list, self.domain_list)):
+            if tck is None:
+                continue
+            lower, upper = domain
+            within = (lower <= X) & (X <= upper)
+            Y[index][within] = si.splev(X[within], tck)
+        return Y if len(self) > 1 else Y[0]
+
+def extract_boundaries (Zv, vals, s = 4e-4, k = 3):
+    '''
+    Extracts the boundaries from the success rates of several targets.
+
+    Parameters
+    ----------
+    Zv : np.ndarray
+        Transmission rates, shape (N, ).
+    vals : np.ndarray
+        Success rates (NaN where no state is certified), shape (T, N, N).
+    s : float
+        Smoothing factor of the splines. To keep the jagged curves as rough
+        as possible, set it as little as you desire.
+    k : int
+        Degree of the splines.
+
+    Returns
+    -------
+    BoundaryCurves
+    '''
+
+    vals = np.asarray(vals)
+
+    # The boundary starts after the last zeta1 without any feasible zeta2.
+    empty = np.all(np.isnan(vals), axis = 2)
+    rows = np.arange(Zv.size)
+    offt = 1 + np.max(np.where(empty, rows, -1), axis = 1)
+
+    # Least feasible zeta2 for each zeta1 and target, all at once.
+    yvec = Zv[np.where(np.isnan(vals), np.inf, vals).argmin(axis = 2)]
+
+    tck_list, domain_list = [], []
+    for offset, target_yvec in zip(offt, yvec):
+        if (Zv.size - offset) <= k:
+            tck_list.append(None)
+            domain_list.append((np.nan, np.nan))
+            continue
+        tck_list.append(si.splrep(Zv[offset:], target_yvec[offset:], k = k, s = s))
+        domain_list.append((Zv[offset], Zv[-1]))
+
+    return BoundaryCurves(tck_list, domain_list)
+
+def dataset_boundaries (dataset, target_list, s = 4e-4, k = 3, cache = True):
+    '''
+    Extracts the boundaries of the given targets of a dataset (see the
+    dataset module). The boundaries are cached next to the dataset, the
+    cached entries are invalidated whenever the target files change.
+
+    Returns
+    -------
+    BoundaryCurves
+    '''
+
+    cache_path = os.path.join(dataset.base_path, BOUNDARY_CACHE)
+    cache_data = {}
+    if cache and os.path.exists(cache_path):
+        cache_data = zstd_pickle_load(cache_path)
+
+    keys = [ (target, s, k) for target in target_list ]
+    stamps = [ _target_stamp(dataset.base_path, target) for target in target_list ]
+    missing = [ index for index, (key, stamp) in enumerate(zip(keys, stamps))
+        if cache_data.get(key, (None, ))[0] != stamp ]
+
+    if missing:
+        vals = dataset.load_many([ target_list[index] for index in missing ], plane = 0)
+        curves = extract_boundaries(dataset.zspace, np.stack(vals), s = s, k = k)
+        for index, tck, domain in zip(missing, curves.tck_list, curves.domain_list):
+            cache_data[keys[index]] = (stamps[index], tck, domain)
+
+        # The datasets might be read-only, the cache is optional.
+        if cache:
+            try:
+                zstd_pickle_dump(cache_path, cache_data)
+            except OSError:
+                pass
+
+    return BoundaryCurves(
+        [ cache_data[key][1] for key in keys ],
+        [ cache_data[key][2] for key in keys ])
+
+def _target_stamp (base_path, target):
+    path = os.path.join(base_path, target)
+    if os.path.isdir(path + TILESTORE_SUFFIX):
+        path = os.path.join(path + TILESTORE_SUFFIX, 'index.npy')
+    else:
+        path = path + '.pickle.zstd'
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
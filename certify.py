@@ -84,3 +84,110 @@ def threshold_curve_certify (curve, x_avg, x_std, x_mul, y_avg, y_std, y_mul):
 
     return True
 
+
+def threshold_curve_certify_vectorized (curve, x_avg, x_std, x_mul, y_avg, y_std, y_mul):
+    '''
+    Vectorized variant of threshold_curve_certify, accepts arrays of any
+    (broadcastable) shape for all the parameters except for the curve.
+
+    Instead of solving for the intersections of the curve with the threshold
+    value, the maximum of the curve over the uncertainty interval of the X
+    coordinate is compared against the threshold. The maximum of a cubic
+    spline is attained either at the edges of the interval or at one of its
+    (few) critical points. For the single-peaked threshold curves the two
+    approaches are equivalent.
+
+    Parameters
+    ----------
+    See threshold_curve_certify.
+
+    Returns
+    -------
+    np.ndarray
+      Indicates whether the bounding box around the mean (X, Y) lies 
+      above the threshold curve.
+    '''
+
+    x_avg, x_std, y_avg, y_std = np.broadcast_arrays(
+        * map(np.asarray, (x_avg, x_std, y_avg, y_std)))
+
+    # Determine the threshold value to check against,
+    # see threshold_curve_certify for the details.
+
+    threshold = y_avg - y_std * y_mul
+    use_top = threshold < 0.0
+    threshold = np.where(use_top, y_avg + y_std * y_mul, threshold)
+    feasible = ~ (use_top & (threshold > 1.0))
+
+    # The threshold value below the whole curve, there is no intersection.
+
+    xC = curve.derivative().roots(extrapolate = False)
+    below = threshold < np.min(curve(np.r_[ curve.x[0], curve.x[-1], xC ]))
+
+    # The uncertainty interval, restricted to the domain of the curve.
+    # Beyond the domain there are no intersections.
+
+    xL = np.maximum(x_avg - x_std * x_mul, curve.x[0])
+    xR = np.minimum(x_avg + x_std * x_mul, curve.x[-1])
+    outside = xL > xR
+
+    # The maximum of the curve over the interval.
+
+    peak = np.maximum(curve(xL), curve(xR))
+    for x in xC:
+        within = (xL <= x) & (x <= xR)
+        peak = np.where(within, np.maximum(peak, curve(x)), peak)
+
+    return feasible & (below | outside | (peak < threshold))
+
+# Columns of the per-rate sufficient statistics.
+
+STATS_PS, STATS_CS, STATS_AX, STATS_SX, STATS_AY, STATS_SY = range(6)
+
+def certified_optimum (Rv, stats, curve, x_mul, y_mul, min_count):
+    '''
+    Finds the squeezing rate maximizing the probability of success among the
+    rates whose ensembles pass the certification. 
+
+    Parameters
+    ----------
+    Rv : np.ndarray
+      Squeezing rates, shape (R, ).
+    stats : np.ndarray
+      Per-rate sufficient statistics of shape (..., R, 6), the last index
+      corresponds to the theoretical probability of success, count of
+      successful heralding events, and the mean and standard deviation of
+      the X and Y coordinates (see STATS_* constants).
+    curve : scipy.interpolate.CubicSpline
+      Threshold curve.
+    x_mul : float
+    y_mul : float
+      Certification factors for the X and Y coordinates.
+    min_count : float
+      Only the rates with more successful heralding events are considered.
+
+    Returns
+    -------
+    np.ndarray
+      Array of shape (..., 6) with the maximal probability of success, the
+      corresponding squeezing rate, and the mean and standard deviation of
+      the X and Y coordinates. Filled with NaN if no rate passes.
+    '''
+
+    Ps = stats[..., STATS_PS]
+    Mx = threshold_curve_certify_vectorized(curve,
+        stats[..., STATS_AX], stats[..., STATS_SX], x_mul,
+        stats[..., STATS_AY], stats[..., STATS_SY], y_mul)
+    Mx = Mx & (stats[..., STATS_CS] > min_count)
+
+    Ix = np.where(Mx, Ps, - np.inf).argmax(axis = -1)
+    Ix = Ix[..., np.newaxis]
+
+    result = np.empty(shape = (* Ps.shape[:-1], 6), dtype = np.float64)
+    result[..., 0] = np.take_along_axis(Ps, Ix, axis = -1)[..., 0]
+    result[..., 1] = np.asarray(Rv)[Ix[..., 0]]
+    for column, index in enumerate([ STATS_AX, STATS_SX, STATS_AY, STATS_SY ]):
+        result[..., 2 + column] = np.take_along_axis(
+            stats[..., index], Ix, axis = -1)[..., 0]
+    result[~ Mx.any(axis = -1)] = np.nan
+    return result
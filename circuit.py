@@ -6,7 +6,25 @@
 import numpy as np
 import scipy.special as ss
 
-def evaluate_circuit_fast (r, zeta1, zeta2, m, d):
+# Upper bound on the dimension chosen by evaluate_circuit_adaptive.
+CIRCUIT_DIMENSION_MAX = 400
+
+# The hypergeometric functions of the circuit are summed as power series,
+# within blocks of CIRCUIT_SERIES_BLOCK squeezing rates, wherever the series
+# provably converges to the relative tolerance CIRCUIT_SERIES_TOL within
+# CIRCUIT_SERIES_TERMS terms, see circuit_hyp2f1. The remaining blocks are
+# evaluated by scipy.special.hyp2f1. Zero terms disable the series.
+CIRCUIT_SERIES_TOL = 1e-15
+CIRCUIT_SERIES_TERMS = 16
+CIRCUIT_SERIES_BLOCK = 64
+
+# The terms of the CAPD expansions are evaluated and accumulated in blocks of
+# CIRCUIT_TERMS_BLOCK terms (k), bounding the memory they take besides the
+# result, see evaluate_circuit_capd_pnrd and evaluate_circuit_shared.
+CIRCUIT_TERMS_BLOCK = 16
+
+def evaluate_circuit_fast (r, zeta1, zeta2, m, d, out = None, 
+    workspace = None):
     '''
     State preparation circuit based on a two mode squeezed vacuum state and
     a photon number resolving detector. The model accounts for the transmission
@@ -18,10 +36,8 @@ def evaluate_circuit_fast (r, zeta1, zeta2, m, d):
 
     This procedure aims to address the performance issues of the reference
     implementation by exploiting broadcasting and vectorization with respect to
-    the first parameter (squeezing rate). While it could theoretically make
-    sense to accept arrays for the other parameters, such as the measurement
-    outcome, all the other parameters, except for the first one, are expected
-    to be scalars.
+    the first parameter (squeezing rate) and the measurement outcome. All the
+    other parameters are expected to be scalars.
 
     Parameters
     ----------
@@ -32,62 +48,314 @@ def evaluate_circuit_fast (r, zeta1, zeta2, m, d):
         Intensity transmittance of the loss channel acting on the heralding mode.
     zeta2 : float
         Intensity transmittance of the loss channel acting on the resulting mode.
-    m : int
+    m : int | np.ndarray
         Targeted Fock state (measurement outcome).
+        Either a scalar value or np.ndarray of shape (T, ) with several
+        outcomes, evaluated at once.
     d : int
         Number of coefficients to compute (dimension)
+    out : np.ndarray | None
+        Array of shape (* r.shape, d), or (T, * r.shape, d) for several
+        outcomes, the coefficients are stored in.
+    workspace : CircuitWorkspace | None
+        Quantities depending only on the squeezing rates r, computed once
+        and reused across the evaluations (see CircuitWorkspace).
 
     Returns
     -------
     float | np.ndarray
         The probability of success.
+        Stacked along the first axis, shape (T, * r.shape), for several outcomes.
     np.ndarray
         The diagonal of the resulting density matrix.
         Its values are generally ill-defined for zero probabilities of success.
+        Stacked along the first axis, shape (T, * r.shape, d), for several 
+        outcomes.
     '''
 
-    # Convert to np.ndarray instance. Converts scalars into (1, ) arrays.
-    srarr = np.atleast_1d(r)
-
     # Substitutions used in the calculation. Note that alpha is np.ndarray now.
-    alpha = (np.tanh(srarr) ** 2)
-    beta1 = 1 - zeta1
-    beta2 = 1 - zeta2
+    workspace = _workspace(r, workspace)
+    alpha = workspace.alpha
+
+    Ps = circuit_success(alpha, zeta1, m)
+    Pn = circuit_coefficients(alpha, zeta1, zeta2, m, np.arange(d), 
+        out = out, powers = workspace.powers(d))
+    if np.ndim(m) == 0:
+        return np.squeeze(Ps), np.squeeze(Pn)
+    return Ps.reshape(-1, * np.shape(r)), Pn.reshape(-1, * np.shape(r), d)
+
+def evaluate_circuit_adaptive (r, zeta1, zeta2, m, tol, d = None, 
+    d_max = CIRCUIT_DIMENSION_MAX, workspace = None):
+    '''
+    Implements the same circuit as evaluate_circuit_fast, choosing the number
+    of coefficients (dimension) instead. The dimension starts at d and grows
+    (doubles) until the truncation error, the probability of the coefficients
+    that were not computed, drops below tol for all the squeezing rates, 
+    or until it reaches d_max. The coefficients are then trimmed to the least
+    dimension (at least d) within tol.
+
+    Parameters
+    ----------
+    r, zeta1, zeta2, m 
+        See evaluate_circuit_fast.
+    tol : float
+        Tolerated truncation error (trace distance to the untruncated state).
+    d : int | None
+        Initial dimension, m + 2 if None.
+    d_max : int
+        Maximal dimension.
+    workspace : CircuitWorkspace | None
+        See evaluate_circuit_fast.
 
-    # Probability of successful detection of (m) photons.
-    Ps = (1 - alpha) * (alpha * zeta1) ** m \
+    Returns
+    -------
+    float | np.ndarray
+        The probability of success.
+    np.ndarray
+        The diagonal of the resulting density matrix, the least sufficient
+        number of coefficients.
+    float | np.ndarray
+        The truncation error, 1 - sum(Pn), for each squeezing rate.
+    '''
+
+    workspace = _workspace(r, workspace)
+    alpha = workspace.alpha
+
+    d = d_min = min(m + 2 if d is None else d, d_max)
+    Ps = circuit_success(alpha, zeta1, m)
+    Pn = circuit_coefficients(alpha, zeta1, zeta2, m, np.arange(d), 
+        powers = workspace.powers(d))
+
+    # (@) Only the missing coefficients are computed as the dimension grows.
+    while (d < d_max) and (truncation_error(Pn).max() > tol):
+        size = min(d, d_max - d)
+        Pn = np.concatenate([ Pn, circuit_coefficients(
+            alpha, zeta1, zeta2, m, np.arange(d, d + size),
+            powers = workspace.powers(d + size)) ], axis = -1)
+        d = d + size
+
+    Pn = _trim_coefficients(Pn, tol, d_min)
+    return np.squeeze(Ps), np.squeeze(Pn), np.squeeze(truncation_error(Pn))
+
+def circuit_success (alpha, zeta1, m):
+    '''
+    Probability of successful detection of (m) photons, alpha = tanh(r) ** 2.
+    For an array of outcomes, shape (T, ), returns an array of shape (T, R).
+    '''
+
+    m = np.reshape(m, (-1, 1)) if np.ndim(m) else m
+    return (1 - alpha) * (alpha * zeta1) ** m \
        / (1 - alpha * (1 - zeta1)) ** (m + 1)
 
-    # Compute the elements of the resulting diagonal density matrix.
+def circuit_coefficients (alpha, zeta1, zeta2, m, N, out = None, 
+    powers = None):
+    '''
+    Computes the coefficients N (consecutive indices) of the diagonal of the
+    resulting density matrix, alpha = tanh(r) ** 2 is an array of shape (R, ),
+    returns an array of shape (R, N.size), stored within out if given. For an
+    array of outcomes m, shape (T, ), the array is of shape (T, R, N.size).
+
+    The coefficients below and above m only differ by the roles of m and n, 
+    they are evaluated at once with hi = max(m, n) and lo = min(m, n),
+
+        P(n) = 2F1(1 + hi, 1 + hi, 1 + hi - lo, X) binom(hi, lo) zeta2 ** n
+             * (1 - beta1 A) ** (1 + m) * S(n),
+
+    where S(n) = beta2 ** (m - n) for n <= m and (beta1 A) ** (n - m) above.
+
+    The powers of alpha, shape (R, P) with P > max(N) - min(m), can be passed
+    in (see CircuitWorkspace). No arrays of the size of the result are
+    allocated besides the result itself.
+    '''
+
+    beta1 = 1 - zeta1
+    beta2 = 1 - zeta2
 
     A = alpha[..., np.newaxis]
     X = beta1 * beta2 * A
-    K = np.arange(0, np.minimum(m + 1, d))
-    L = np.arange(m + 1, d)
-
-    Pn = np.zeros(shape = (* srarr.shape, d))
-    if K.size:
-        Pn[..., K] = ss.hyp2f1(1 + m, 1 + m, 1 + m - K, X) * ss.binom(m, K) \
-                   * (zeta2 ** K) * beta2 ** (m - K)
-    if L.size:
-        Pn[..., L] = ss.hyp2f1(1 + L, 1 + L, 1 + L - m, X) * ss.binom(L, m) \
-                   * (zeta2 ** L) * beta1 ** (L - m) * A ** (L - m)
-    Pn = Pn * (1 - beta1 * A) ** (1 + m)
-    
-    return np.squeeze(Ps), np.squeeze(Pn)
-
-def evaluate_circuit_pnrd_pnrd (r, z1, z2, m, d):
+
+    # (@) Outcomes along the first axis, (T, 1, 1) against the (R, N) cells.
+    M = np.reshape(m, (-1, 1, 1))
+    HI = np.maximum(M, N)
+    LO = np.minimum(M, N)
+
+    Pn = np.empty(shape = (M.shape[0], * alpha.shape, N.size)) if out is None \
+        else (out if np.ndim(m) else out[np.newaxis])
+    circuit_hyp2f1(1.0 + HI, 1.0 + HI - LO, X, out = Pn)
+    Pn *= ss.binom(HI, LO) * (zeta2 ** N) * np.where(N <= M, 
+        beta2 ** np.maximum(M - N, 0), 
+        beta1 ** np.maximum(N - M, 0))
+
+    # The powers of alpha above m, sliced from the table.
+    for Pm, mt in zip(Pn, M.flat):
+        j = max(0, mt + 1 - N[0])
+        if j < N.size:
+            if powers is None:
+                Pm[..., j:] *= A ** (N[j:] - mt)
+            else:
+                Pm[..., j:] *= powers[..., N[j] - mt:N[-1] - mt + 1]
+    Pn *= (1 - beta1 * A) ** (1 + M)
+    return Pn if np.ndim(m) else Pn[0]
+
+def circuit_hyp2f1 (a, c, X, out):
+    '''
+    Computes 2F1(a, a, c, X) of the circuit, the parameters a >= c >= 1 of 
+    shape (T, 1, N) and the arguments 0 <= X < 1 of shape (R, 1), into out of
+    shape (T, R, N).
+
+    The terms of the series, t(0) = 1 and t(j + 1) = t(j) q(j) X, with
+
+        q(j) = (a + j) ** 2 / ((c + j) (j + 1)),
+
+    are positive and q(j) decreases. With rho = q(J) X < 1, the remainder past
+    the first J terms is bounded by t(J) / (1 - rho), relative to the sum
+    (at least one). Within each block of the squeezing rates, the bound is
+    evaluated for the largest argument (all the terms grow with X), the
+    series is summed if it meets CIRCUIT_SERIES_TOL within
+    CIRCUIT_SERIES_TERMS terms, which is the case for weak squeezing (and
+    low loss). The other blocks are evaluated by scipy.special.hyp2f1. 
+    Either way, the values are computed in place within out.
+    '''
+
+    X = np.asarray(X, dtype = np.float64)
+    bounds = np.arange(0, X.shape[0], CIRCUIT_SERIES_BLOCK)
+    terms = np.zeros(bounds.size, dtype = int)
+
+    # (@) The number of terms of each block, all the blocks and the terms at
+    #     once. The bound is taken for the largest t(J) and q(J) of all the
+    #     parameters, which keeps it within (blocks, terms). It fails by 
+    #     itself for rho >= 1.
+    if CIRCUIT_SERIES_TERMS > 0:
+        j = np.arange(CIRCUIT_SERIES_TERMS)
+        q = (a[..., np.newaxis] + j) ** 2 / ((c[..., np.newaxis] + j) * (j + 1))
+        q = q.reshape(-1, j.size)
+        C = np.cumprod(q[:, :-1], axis = -1).max(axis = 0)
+        Xmax = np.maximum.reduceat(X[:, 0], bounds)[:, np.newaxis]
+        t = C * Xmax ** j[1:]
+        rho = CIRCUIT_SERIES_TOL * (1.0 - q[:, 1:].max(axis = 0) * Xmax)
+        converged = t <= rho
+        terms = np.where(converged.any(axis = -1), 1 + converged.argmax(axis = -1), 0)
+        Q = q.T.reshape(j.size, * np.broadcast_shapes(a.shape, c.shape))
+
+    # Consecutive blocks of the same number of terms are summed together.
+    # (@) The series is summed in place (Horner's scheme), 
+    #     1 + q(0) X (1 + q(1) X (1 + ...)).
+    runs = np.flatnonzero(np.diff(terms, prepend = -1))
+    for beg, end, J in zip(bounds[runs], [ * bounds[runs[1:]], X.shape[0] ], terms[runs]):
+        S, Xr = out[:, beg:end], X[beg:end]
+        if J == 0:
+            ss.hyp2f1(a, a, c, Xr, out = S)
+            continue
+        S.fill(1.0)
+        for j in reversed(range(J - 1)):
+            S *= Q[j]
+            S *= Xr
+            S += 1.0
+    return out
+
+def _term_blocks (K, weights = None):
+    # The blocks of the terms k < K (of non-zero weight), aligned so that the
+    # mixtures of any weights sum the terms in the same order.
+    for beg in range(0, K, CIRCUIT_TERMS_BLOCK):
+        ks = np.arange(beg, min(beg + CIRCUIT_TERMS_BLOCK, K))
+        if weights is not None:
+            ks = ks[np.flatnonzero(weights[ks])]
+        if ks.size:
+            yield ks
+
+def _workspace (r, workspace):
+    # (@) The workspace of other squeezing rates would silently be used.
+    if workspace is None:
+        return CircuitWorkspace(r)
+    if not np.array_equal(workspace.r, np.atleast_1d(r)):
+        raise ValueError('The workspace belongs to other squeezing rates')
+    return workspace
+
+class CircuitWorkspace:
+    '''
+    Quantities depending only on the squeezing rates, alpha = tanh(r) ** 2 and
+    its powers, and scratch buffers, all of them reused across the evaluations
+    of the circuits for the same squeezing rates. Workers evaluating many
+    cells over the same rates keep a single workspace, the circuits then 
+    allocate no arrays of the size of their results.
+
+    Example
+    -------
+        W = CircuitWorkspace(Rv)
+        Pn = W.buffer('result', d)
+        Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, z1, z2, m, d, 
+            out = Pn, workspace = W)
+    '''
+
+    def __init__ (self, r):
+        self.r = np.atleast_1d(r)
+        self.alpha = np.tanh(self.r) ** 2
+        self._powers = np.ones((* self.r.shape, 1))
+        self._buffers = {}
+
+    def powers (self, n):
+        '''
+        Returns alpha ** j for j < n (at least), shape (R, n) or wider.
+        '''
+
+        if self._powers.shape[-1] < n:
+            self._powers = self.alpha[..., np.newaxis] ** np.arange(n)
+        return self._powers
+
+    def buffer (self, name, d, count = None):
+        '''
+        Returns the named buffer of shape (R, d), or (count, R, d) for stacked
+        outcomes, allocated on first use. Its contents are only valid until
+        it is requested again.
+        '''
+
+        shape = (* self.r.shape, d) if count is None else (count, * self.r.shape, d)
+        key = (name, shape)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(shape)
+        return self._buffers[key]
+
+def truncation_error (Pn):
+    '''
+    Probability of the coefficients beyond the computed ones, 1 - sum(Pn).
+    '''
+
+    return np.clip(1.0 - Pn.sum(axis = -1), 0.0, 1.0)
+
+def evaluate_circuit_pnrd_pnrd (r, z1, z2, m, d, tail = False, tol = None,
+    out = None, workspace = None):
     '''
     Implements the state preparation circuit with 
     (*) PNRD detector used for heralding, and
     (*) PNRD detector used for characterization of the prepared state.
 
-    See evaluate_circuit or evaluate_circuit_fast for details.
+    With tail, only the first d coefficients are computed and the remaining
+    probability (the tail) is appended, see append_tail.
+
+    With tol, the dimension is chosen (starting at d) so that the truncation
+    error does not exceed tol, see evaluate_circuit_adaptive, and the
+    truncation error is returned as well.
+
+    The coefficients are stored within out, shape (R, d) or (R, d + 1) with
+    tail, if given (it is not used with tol). See evaluate_circuit or 
+    evaluate_circuit_fast for details, and for the workspace.
     '''
 
-    return evaluate_circuit_fast(r, z1, z2, m, d)
+    if tol is not None:
+        Ps, Pn, error = evaluate_circuit_adaptive(r, z1, z2, m, tol, d, 
+            workspace = workspace)
+        return (Ps, append_tail(Pn) if tail else Pn, error)
+
+    if not tail:
+        return evaluate_circuit_fast(r, z1, z2, m, d, 
+            out = out, workspace = workspace)
+
+    Ps, Pn = evaluate_circuit_fast(r, z1, z2, m, d, 
+        out = None if out is None else out[..., :d], workspace = workspace)
+    return Ps, np.squeeze(append_tail(Pn, out = out))
 
-def evaluate_circuit_capd_pnrd (r, z1, z2, m, M, K, d):
+def evaluate_circuit_capd_pnrd (r, z1, z2, m, M, K, d, weights = None, 
+    tail = False, tol = None, out = None, workspace = None):
     '''
     Implements the state preparation circuit with 
     (*) CAPD detector used for heralding, 
@@ -95,16 +363,171 @@ def evaluate_circuit_capd_pnrd (r, z1, z2, m, M, K, d):
         the computation uses expansion up to K elements, and
     (*) PNRD detector used for characterization of the prepared state.
 
+    The weights of the expansion, see detector_capd_weights, can be passed
+    in when evaluated repeatedly for the same detector.
+
+    With tail, only the first d coefficients are computed and the remaining
+    probability (the tail) is appended, see append_tail.
+
+    With tol, the dimension is chosen (starting at d) so that the truncation
+    error of the mixture does not exceed tol, and the truncation error is
+    returned as well, see evaluate_circuit_pnrd_pnrd.
+
+    The out and workspace arguments are those of evaluate_circuit_pnrd_pnrd,
+    the terms of the expansion are computed within a buffer of the workspace,
+    CIRCUIT_TERMS_BLOCK terms at a time, and accumulated into the result.
+
     See evaluate_circuit or evaluate_circuit_fast for details.
     '''
 
-    Os, On = 0.0, 0.0
-    for k in np.arange(K):
-        Wk = _detector_capd_weights(m, M, k)
-        Ps, Pn = evaluate_circuit_pnrd_pnrd(r, z1, z2, k, d)
-        Os += Wk * (Ps)
-        On += Wk * (Pn * Ps[..., np.newaxis])
-    return Os, On / Os[..., np.newaxis]
+    if weights is None:
+        weights = detector_capd_weights(m, M, K)
+    workspace = _workspace(r, workspace)
+
+    if tol is not None:
+        Os, On, d_min = 0.0, 0.0, m + 2 if d is None else d
+        for k in np.arange(K):
+            Wk = weights[k]
+            # (@) Each term starts at the dimension of the previous ones, the
+            #     mixture of the terms truncated within tol is within tol.
+            Ps, Pn, _ = evaluate_circuit_pnrd_pnrd(r, z1, z2, k, d, tol = tol,
+                workspace = workspace)
+            On = _pad_coefficients(On, Pn.shape[-1])
+            d = Pn.shape[-1]
+            Os += Wk * (Ps)
+            On += Wk * (Pn * Ps[..., np.newaxis])
+        On = _trim_coefficients(On / Os[..., np.newaxis], tol, d_min)
+        return (Os, append_tail(On) if tail else On, truncation_error(On))
+
+    # (@) The terms of non-zero weight (k >= m) are evaluated a block at a
+    #     time, weighted in place and accumulated.
+    Os = np.zeros(workspace.r.shape)
+    On = np.empty((* workspace.r.shape, d)) if out is None else out[..., :d]
+    On.fill(0.0)
+    mixture = workspace.buffer('capd_mixture', d)
+    for ks in _term_blocks(K, weights):
+        terms = workspace.buffer('capd_terms', d, CIRCUIT_TERMS_BLOCK)[:ks.size]
+        Ps, _ = evaluate_circuit_fast(r, z1, z2, ks, d, 
+            out = terms, workspace = workspace)
+        Ps = np.reshape(Ps, (ks.size, * workspace.r.shape))
+        terms *= Ps[..., np.newaxis]
+        Os += np.einsum('k, kr -> r', weights[ks], Ps)
+        On += np.einsum('k, krd -> rd', weights[ks], terms, out = mixture)
+    On /= Os[..., np.newaxis]
+
+    if tail:
+        return np.squeeze(Os), np.squeeze(append_tail(On, out = out))
+    return np.squeeze(Os), np.squeeze(On)
+
+def evaluate_circuit_shared (r, z1, z2, d, pnrd_list, capd_list, K, 
+    weights = None, workspace = None):
+    '''
+    Implements the state preparation circuits of several heralding detectors
+    sharing the transmittances, 
+    (*) PNRD detectors post-selecting on m photons, m in pnrd_list, and
+    (*) CAPD detectors of M avalanche detectors post-selecting on m clicks,
+        (m, M) in capd_list, with expansion up to K elements,
+    all of them with PNRD detector used for characterization.
+
+    The CAPD circuits are mixtures of the PNRD circuits, k < K, see
+    evaluate_circuit_capd_pnrd. The PNRD terms are computed once, in blocks
+    of CIRCUIT_TERMS_BLOCK terms (see evaluate_circuit_fast), and shared by 
+    all the circuits.
+
+    Parameters
+    ----------
+    r, z1, z2, d
+        See evaluate_circuit_fast.
+    pnrd_list : list
+        Outcomes m of the PNRD heralding.
+    capd_list : list
+        Pairs (m, M) of the CAPD heralding.
+    K : int
+        Number of elements of the expansion of the CAPD detectors.
+    weights : dict | None
+        Weights of the expansion for each (m, M), see detector_capd_weights.
+    workspace : CircuitWorkspace | None
+        See evaluate_circuit_fast.
+
+    Returns
+    -------
+    dict
+        Maps m of pnrd_list to (Ps, Pn), shapes (R, ) and (R, d).
+    dict
+        Maps (m, M) of capd_list to (Ps, Pn), shapes (R, ) and (R, d).
+    '''
+
+    workspace = _workspace(r, workspace)
+    weights = dict(weights or {})
+    for m, M in capd_list:
+        if (m, M) not in weights:
+            weights[m, M] = detector_capd_weights(m, M, K)
+
+    # (@) The mixtures of the weighted terms, all of them at once, 
+    #     accumulated a block of the terms at a time.
+    size = max([ 1 + m for m in pnrd_list ] + [ K if capd_list else 0 ])
+    Wm = np.array([ np.pad(weights[key][:K], (0, max(0, size - K)))[:size] 
+        for key in capd_list ]).reshape(len(capd_list), size)
+    Os = np.zeros((len(capd_list), * workspace.r.shape))
+    On = np.zeros((len(capd_list), * workspace.r.shape, d))
+    mixture = workspace.buffer('shared_mixture', d, len(capd_list))
+    pnrd = {}
+    for ks in _term_blocks(size):
+        terms = workspace.buffer('shared_terms', d, CIRCUIT_TERMS_BLOCK)[:ks.size]
+        Ps, _ = evaluate_circuit_fast(r, z1, z2, ks, d, 
+            out = terms, workspace = workspace)
+        Ps = np.reshape(Ps, (ks.size, * workspace.r.shape))
+        for m in pnrd_list:
+            if ks[0] <= m <= ks[-1]:
+                pnrd[m] = (Ps[m - ks[0]], terms[m - ks[0]].copy())
+        terms *= Ps[..., np.newaxis]
+        Os += np.einsum('ck, kr -> cr', Wm[:, ks], Ps)
+        On += np.einsum('ck, krd -> crd', Wm[:, ks], terms, out = mixture)
+    On /= Os[..., np.newaxis]
+    pnrd = { m : pnrd[m] for m in pnrd_list }
+    capd = { key : (Os[index], On[index]) for index, key in enumerate(capd_list) }
+    return pnrd, capd
+
+def _trim_coefficients (Pn, tol, d):
+    # The least dimension, at least d, of the truncation error within tol.
+    error = np.max(1.0 - np.cumsum(Pn, axis = -1), 
+        axis = tuple(range(Pn.ndim - 1)))
+    within = np.flatnonzero(error[d - 1:] <= tol)
+    return Pn[..., :d + within[0]] if within.size else Pn
+
+def _pad_coefficients (On, d):
+    if np.ndim(On) == 0 or On.shape[-1] == d:
+        return On
+    return np.concatenate([ On, 
+        np.zeros((* On.shape[:-1], d - On.shape[-1])) ], axis = -1)
+
+def append_tail (Pn, out = None):
+    '''
+    Appends the probability of all the coefficients beyond the computed ones,
+    1 - sum(Pn), which follows from the normalization of the state. 
+
+    The certification only depends on P(m) and the probability of the
+    coefficients above m. These follow exactly from the first m + 1
+    coefficients and the tail, without any truncation error.
+
+    The result is stored within out if given, Pn can be its leading part.
+    '''
+
+    if out is None:
+        out = np.empty((* Pn.shape[:-1], Pn.shape[-1] + 1))
+    if not np.shares_memory(out, Pn):
+        out[..., :-1] = Pn
+    np.clip(1.0 - Pn.sum(axis = -1), 0.0, 1.0, out = out[..., -1])
+    return out
+
+def detector_capd_weights (m, M, K):
+    '''
+    Computes the first K weights w(m, M, j) of the POVM element associated
+    with m clicks of a cascade of M avalanche detectors.
+    See _detector_capd_weights for details.
+    '''
+
+    return _detector_capd_weights(m, M, np.arange(K))
 
 @np.vectorize(signature = '(), (), () -> ()')
 def _detector_capd_weights (m, M, j):
@@ -0,0 +1,110 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module implements a loader of the precomputed datasets (see the
+# results/README) used by the figure scripts.
+#
+# The individual targets are loaded lazily, in parallel threads, and only the
+# requested planes are kept. The loaded arrays are cached for the lifetime of
+# the process, all the plots drawn from the same dataset share them.
+
+import os
+import threading
+import concurrent.futures as cf
+
+import numpy as np
+
+from helpers import zstd_pickle_load
+from tilestore import TileStore, TILESTORE_SUFFIX
+
+DATASET_THREADS = 8
+
+_dataset_lock = threading.Lock()
+_dataset_cache = {}
+_dataset_executor = None
+
+class Dataset:
+    '''
+    A dataset directory, e.g. results/unified.10dB.1001.
+
+    Example
+    -------
+        D = Dataset('../results/unified.10dB.51')
+        D.prefetch([ 'pnrd_pnrd_04', 'pnrd_pnrd_05' ], plane = 0)
+
+        Zv = D.zspace
+        Ps = D.load('pnrd_pnrd_04', plane = 0) # ... the success rates
+    '''
+
+    def __init__ (self, base_path):
+        self.base_path = os.path.realpath(base_path)
+
+    def __repr__ (self):
+        return f'Dataset({self.base_path!r})'
+
+    @property
+    def rspace (self):
+        return self.load('rspace')
+
+    @property
+    def zspace (self):
+        return self.load('zspace')
+
+    def submit (self, target, plane = None):
+        '''
+        Schedules loading of a target (or returns the cached one).
+
+        Parameters
+        ----------
+        target : str
+            Name of the target, e.g. pnrd_pnrd_04 or capd_pnrd_04_20.
+        plane : int | tuple | None
+            Planes (the third index) to keep, all of them if None.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future resolving to the loaded array.
+        '''
+
+        if isinstance(plane, list):
+            plane = tuple(plane)
+        key = (self.base_path, target, plane)
+
+        with _dataset_lock:
+            if key not in _dataset_cache:
+                _dataset_cache[key] = _get_executor().submit(
+                    _dataset_load, self.base_path, target, plane)
+            return _dataset_cache[key]
+
+    def prefetch (self, target_list, plane = None):
+        for target in target_list:
+            self.submit(target, plane)
+
+    def load (self, target, plane = None):
+        return self.submit(target, plane).result()
+
+    def load_many (self, target_list, plane = None):
+        futures = [ self.submit(target, plane) for target in target_list ]
+        return [ future.result() for future in futures ]
+
+def _get_executor ():
+    global _dataset_executor
+    if _dataset_executor is None:
+        _dataset_executor = cf.ThreadPoolExecutor(DATASET_THREADS)
+    return _dataset_executor
+
+def _dataset_load (base_path, target, plane):
+    path = os.path.join(base_path, target)
+    if isinstance(plane, tuple):
+        plane = list(plane)
+
+    # Tile stores only copy the requested planes.
+    if os.path.isdir(path + TILESTORE_SUFFIX):
+        with TileStore.open(path + TILESTORE_SUFFIX) as store:
+            return store.read() if plane is None else store[:, :, plane]
+
+    # Compressed pickles are inflated whole, only the planes are kept.
+    data = zstd_pickle_load(path + '.pickle.zstd')
+    if (plane is None) or (np.ndim(data) < 3):
+        return data
+    return np.array(data[:, :, plane])
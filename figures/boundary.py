@@ -0,0 +1 @@
+../boundary.py
\ No newline at end of file
@@ -3,30 +3,34 @@
 
 import numpy as np
 import matplotlib.pyplot as mpp
-from helpers import zstd_pickle_load
+from dataset import Dataset
 
 def make_paper_plot (base_path, target_list, label = None):
-    Rv = zstd_pickle_load(f'{base_path}/rspace.pickle.zstd')
-    Zv = zstd_pickle_load(f'{base_path}/zspace.pickle.zstd')
+    dataset = Dataset(base_path)
+    Zv = dataset.zspace
     
     xgrid, ygrid = np.meshgrid((1 - Zv), (1 - Zv), indexing = 'ij')
     dmask = ~ np.logical_and(xgrid <= 0.40, ygrid <= 0.30)
     
     task_spec_list = [
         [
-            (f'{base_path}/pnrd_pnrd_{targetm:02}.pickle.zstd',
+            (f'pnrd_pnrd_{targetm:02}',
                 f'PNR ($m = {targetm}$)'),
-            (f'{base_path}/capd_pnrd_{targetm:02}_20.pickle.zstd',
+            (f'capd_pnrd_{targetm:02}_20',
                 f'CAP ($n = 20, m = {targetm}$)'),
-            (f'{base_path}/capd_pnrd_{targetm:02}_15.pickle.zstd',
+            (f'capd_pnrd_{targetm:02}_15',
                 f'CAP ($n = 15, m = {targetm}$)'),
-            (f'{base_path}/capd_pnrd_{targetm:02}_10.pickle.zstd', 
+            (f'capd_pnrd_{targetm:02}_10', 
                 f'CAP ($n = 10, m = {targetm}$)'),
         ]
         for targetm in target_list
     ]
     task_spec_list_cols = 4
     task_spec_list_rows = len(task_spec_list)
+
+    # Only the success rates are needed, load them all in parallel.
+    dataset.prefetch([ target for spec_list in task_spec_list 
+        for target, _ in spec_list ], plane = 0)
     
     cmapP = 'turbo'
     vminP = -5.0
@@ -37,10 +41,10 @@ def make_paper_plot (base_path, target_list, label = None):
 
     for row, spec_list in enumerate(task_spec_list):
         for col, task_spec in enumerate(spec_list):
-            file_path, plot_name = task_spec
-            task_data = zstd_pickle_load(file_path)
+            target, plot_name = task_spec
+            task_data = dataset.load(target, plane = 0)
         
-            pdata = np.log10(task_data[:, :, 0])    
+            pdata = np.log10(task_data)    
             pdata[dmask] = np.nan
             
             axs[row, col].pcolormesh(
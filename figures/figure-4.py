@@ -2,48 +2,29 @@
 #
 
 import numpy as np
-import scipy.interpolate as si
 import matplotlib.pyplot as mpp
 import matplotlib.patches as mpx
 
-from helpers import zstd_pickle_load, transform
-
-def make_curve (Zv, path):
-    data = zstd_pickle_load(path)
-    vals = data[:, :, 0]
-    offt = 1 + np.max(np.where(np.isnan(np.nanmin(vals, axis = 1))), initial = -1)
-    yvec = Zv[np.nanargmin(vals[offt:, :], axis = 1)]
+from dataset import Dataset
+from boundary import dataset_boundaries
 
+def load_dataset (base, pattern_list, target_list):
     # Smoothen the jagged curves a little.
     # Alternatively, to keep them as rough as possible, 
     # set the s parameter as little as you desire.
-    return make_splev(Zv[offt:], yvec, s = 4e-4)
-
-def make_splev (x, y, s, k = 3):
-    t = si.splrep(x, y, k = k, s = s)
-    def curve (X):
-        try:
-            return si.splev(X, t, ext = 2)
-        except ValueError:
-            return np.nan
-    return np.vectorize(curve)
-
-@transform(list)
-def load_dataset (base, pattern, target_list):
-    Rv = zstd_pickle_load(f'{base}/rspace.pickle.zstd')
-    Zv = zstd_pickle_load(f'{base}/zspace.pickle.zstd')
-
-    for target in target_list:
-        yield make_curve(Zv, f'{base}/{pattern.format(target)}')
+    return dataset_boundaries(Dataset(base), [ 
+        pattern.format(target) 
+        for pattern in pattern_list 
+        for target in target_list ], s = 4e-4)
 
 def value_if_nan (data, value = 0.0):
     data[np.isnan(data)] = value
     return data
 
 def make_plot (base, label):
-    dataset_pnrd = load_dataset(base, 'pnrd_pnrd_{:02}.pickle.zstd', [ 3, 4, 5 ])
-    dataset_capd_20 = load_dataset(base, 'capd_pnrd_{:02}_20.pickle.zstd', [ 3, 4, 5 ])
-    dataset_capd_10 = load_dataset(base, 'capd_pnrd_{:02}_10.pickle.zstd', [ 3, 4, 5 ])
+    curves = load_dataset(base, 
+        [ 'pnrd_pnrd_{:02}', 'capd_pnrd_{:02}_20', 'capd_pnrd_{:02}_10' ], 
+        [ 3, 4, 5 ])
 
     color_list = [ '#000', '#f00', '#00f' ]
 
@@ -51,13 +32,14 @@ def make_plot (base, label):
     axs = fig.subplots(1, 1)
 
     xvec = np.linspace(0.6, 1.0, 201)
-
-    for curve, color in zip(dataset_pnrd, color_list):
-        axs.plot(1 - xvec, 1 - curve(xvec), color = color, linestyle = 'solid')
-    for curve, color in zip(dataset_capd_20, color_list):
-        axs.plot(1 - xvec, 1 - curve(xvec), color = color, linestyle = 'dashed')
-    for curve, color in zip(dataset_capd_10, color_list):
-        axs.plot(1 - xvec, value_if_nan(1 - curve(xvec)), color = color, linestyle = 'dotted')
+    yvec_pnrd, yvec_capd_20, yvec_capd_10 = curves(xvec).reshape(3, 3, -1)
+
+    for yvec, color in zip(yvec_pnrd, color_list):
+        axs.plot(1 - xvec, 1 - yvec, color = color, linestyle = 'solid')
+    for yvec, color in zip(yvec_capd_20, color_list):
+        axs.plot(1 - xvec, 1 - yvec, color = color, linestyle = 'dashed')
+    for yvec, color in zip(yvec_capd_10, color_list):
+        axs.plot(1 - xvec, value_if_nan(1 - yvec), color = color, linestyle = 'dotted')
 
 
     axs.axis([ 0, 0.40, 0, 0.40 ])
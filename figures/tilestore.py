@@ -0,0 +1 @@
+../tilestore.py
\ No newline at end of file
@@ -1,22 +1,32 @@
 # 2025 Jan Provaznik (provaznik@optics.upol.cz)
 #
 
+import os
 import sys
 import tqdm
 
+import json
+import math
 import time
 import pickle
+import socket
+import resource
+import contextlib
+import collections
+import concurrent.futures as cf
 import zstandard as zstd
 import numpy as np
 
+from tilestore import TileStore, TILESTORE_SUFFIX
+
 # Helpers: timing execution
 #
 
 class Stopwatch:
     def __enter__ (self, * args):
-        self._tic = time.time()
+        self._tic = time.perf_counter()
     def __exit__ (self, * args):
-        self._toc = time.time()
+        self._toc = time.perf_counter()
     def __call__ (self):
         return float(self)
     def __float__ (self):
@@ -24,6 +34,248 @@ class Stopwatch:
     def __str__ (self):
         return f'Execution took {float(self)} seconds.'
 
+# Helpers: profiling execution
+#
+# Nested, named stages are timed by the process-wide profiler,
+#
+#   with stage('sampling'):
+#       with stage('multinomial'):
+#           ...
+#
+# accumulating the total time and count of each stage under its path (e.g.
+# 'sampling/multinomial'). The stages of each task are collected by taskwrap
+# and aggregated by the dispatcher into a per-target report.
+
+class Profiler:
+    def __init__ (self):
+        self._stack = []
+        self._stages = {}
+
+    @contextlib.contextmanager
+    def __call__ (self, name):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            toc = time.perf_counter()
+            self._stack.pop()
+            total, count = self._stages.get(path, (0.0, 0))
+            self._stages[path] = (total + (toc - tic), count + 1)
+
+    def collect (self):
+        stages, self._stages = self._stages, {}
+        return stages
+
+profiler = Profiler()
+
+def stage (name):
+    return profiler(name)
+
+def worker_identity ():
+    # The rank within MPI.COMM_WORLD, or the process elsewhere.
+    MPI = sys.modules.get('mpi4py.MPI')
+    if MPI is not None:
+        return f'rank-{MPI.COMM_WORLD.Get_rank()}'
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+# The peak resident memory of each task is measured by resetting the peak of
+# the process before the task (Linux only, elsewhere the peak of the whole
+# lifetime of the process is reported). It includes the memory the process 
+# holds besides the task, e.g. the interpreter and the modules.
+
+def reset_peak_memory ():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+def peak_memory ():
+    # The peak resident memory of the process in bytes.
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return 1024 * int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+class TimingReport:
+    '''
+    Aggregates the timing of the tasks of a single target, both per stage
+    and per worker, and the largest peak memory of the tasks.
+    '''
+
+    def __init__ (self, name):
+        self.name = name
+        self.wall = 0.0
+        self.tasks = 0
+        self.busy = 0.0
+        self.memory = 0
+        self.stages = {}
+        self.workers = {}
+
+    def add (self, task_exec):
+        self.tasks += 1
+        self.busy += task_exec['time']
+        self.memory = max(self.memory, task_exec.get('memory', 0))
+        _merge_stages(self.stages, task_exec['stages'])
+
+        worker = self.workers.setdefault(task_exec['worker'], 
+            { 'tasks' : 0, 'busy' : 0.0, 'memory' : 0, 'stages' : {} })
+        worker['tasks'] += 1
+        worker['busy'] += task_exec['time']
+        worker['memory'] = max(worker['memory'], task_exec.get('memory', 0))
+        _merge_stages(worker['stages'], task_exec['stages'])
+
+    def as_dict (self):
+        return {
+            'target' : self.name,
+            'wall' : self.wall,
+            'tasks' : self.tasks,
+            'busy' : self.busy,
+            'memory' : self.memory,
+            'stages' : { path : { 'total' : total, 'count' : count }
+                for path, (total, count) in self.stages.items() },
+            'workers' : { name : {
+                'tasks' : worker['tasks'],
+                'busy' : worker['busy'],
+                'memory' : worker['memory'],
+                'stages' : { path : { 'total' : total, 'count' : count }
+                    for path, (total, count) in worker['stages'].items() }
+            } for name, worker in self.workers.items() }
+        }
+
+    def write (self, path):
+        with open(path, 'w') as file:
+            json.dump(self.as_dict(), file, indent = 2)
+
+    def __str__ (self):
+        lines = [ f'{"stage":40} {"total [s]":>12} {"mean [ms]":>12} {"share":>7}' ]
+        for path, (total, count) in sorted(self.stages.items()):
+            depth = path.count('/')
+            label = '  ' * depth + path.rsplit('/', 1)[-1]
+            share = total / self.busy if self.busy else 0.0
+            lines.append(f'{label:40} {total:12.3f} {1e3 * total / count:12.3f} {share:7.1%}')
+        lines.append(f'{self.tasks} tasks on {len(self.workers)} workers, '
+            f'{self.busy:.3f} s busy, {self.wall:.3f} s wall, '
+            f'peak memory {self.memory / 2 ** 20:.1f} MB')
+        return '\n'.join(lines)
+
+# Per-task telemetry, one row per computed cell. The timestamps are relative
+# to the start of the dispatch. The wait is the time between the worker
+# finishing the task and the master receiving its result, comprising the
+# serialization, the transfer and the queueing on the master. The workers and
+# the master read their own clocks, the timestamps of remote workers are only
+# as accurate as the synchronization of the clocks. The memory is the
+# peak resident memory of the worker during the task (see peak_memory).
+
+TELEMETRY_DTYPE = np.dtype([
+    ('i1', np.int32), ('i2', np.int32), ('worker', np.int32),
+    ('start', np.float64), ('end', np.float64), ('compute', np.float64),
+    ('arrive', np.float64), ('wait', np.float64), ('memory', np.int64) ])
+
+# Cells computed this many times slower than the median are stragglers.
+TELEMETRY_STRAGGLER = 3.0
+
+class Telemetry:
+    '''
+    Collects the per-task telemetry of a single target, see TELEMETRY_DTYPE,
+    and summarizes the utilization of the workers.
+    '''
+
+    def __init__ (self, name):
+        self.name = name
+        self.origin = time.time()
+        self.workers = {}
+        self._rows = []
+
+    def add (self, task_head, task_exec, arrive):
+        worker = self.workers.setdefault(task_exec['worker'], len(self.workers))
+        self._rows.append((* task_head, worker,
+            task_exec['start'] - self.origin,
+            task_exec['end'] - self.origin,
+            task_exec['time'],
+            arrive - self.origin,
+            arrive - task_exec['end'],
+            task_exec.get('memory', 0)))
+
+    def table (self):
+        return np.array(self._rows, dtype = TELEMETRY_DTYPE)
+
+    def summary (self, count = 5):
+        '''
+        Summarizes the telemetry: the throughput in cells per second, the
+        idle fraction of each worker (and overall) within the span of the
+        dispatch, and the slowest cells (at most count of them) among the
+        stragglers.
+        '''
+
+        table = self.table()
+        if not table.size:
+            return {}
+
+        span = table['arrive'].max()
+        busy = np.bincount(table['worker'], 
+            weights = table['compute'], minlength = len(self.workers))
+        names = list(self.workers)
+
+        median = np.median(table['compute'])
+        slow = table[table['compute'] > TELEMETRY_STRAGGLER * median]
+        slow = slow[np.argsort(slow['compute'])[::-1][:count]]
+
+        return {
+            'cells' : int(table.size),
+            'span' : float(span),
+            'throughput' : float(table.size / span) if span > 0 else 0.0,
+            'idle' : float(1.0 - busy.sum() / (busy.size * span)) if span > 0 else 0.0,
+            'workers' : { name : float(1.0 - busy[index] / span) if span > 0 else 0.0
+                for index, name in enumerate(names) },
+            'compute_median' : float(median),
+            'wait_median' : float(np.median(table['wait'])),
+            'wait_max' : float(table['wait'].max()),
+            'memory_median' : float(np.median(table['memory'])),
+            'memory_max' : int(table['memory'].max()),
+            'stragglers' : int(np.sum(table['compute'] > TELEMETRY_STRAGGLER * median)),
+            'slowest' : [ (int(row['i1']), int(row['i2']), float(row['compute']),
+                names[row['worker']]) for row in slow ] }
+
+    def write (self, path):
+        zstd_pickle_dump(path, {
+            'target' : self.name,
+            'origin' : self.origin,
+            'workers' : list(self.workers),
+            'tasks' : self.table(),
+            'summary' : self.summary() })
+
+    def __str__ (self):
+        summary = self.summary()
+        if not summary:
+            return f'{self.name}: no tasks'
+        lines = [
+            f'{summary["cells"]} cells in {summary["span"]:.3f} s, '
+            f'{summary["throughput"]:.2f} cells/s, '
+            f'{summary["idle"]:.1%} idle on {len(self.workers)} workers',
+            f'median compute {1e3 * summary["compute_median"]:.3f} ms, '
+            f'median wait {1e3 * summary["wait_median"]:.3f} ms, '
+            f'max wait {1e3 * summary["wait_max"]:.3f} ms',
+            f'median peak memory {summary["memory_median"] / 2 ** 20:.1f} MB, '
+            f'max peak memory {summary["memory_max"] / 2 ** 20:.1f} MB',
+            f'{summary["stragglers"]} stragglers '
+            f'(over {TELEMETRY_STRAGGLER:g} times the median)' ]
+        for i1, i2, compute, worker in summary['slowest']:
+            lines.append(f'  cell ({i1}, {i2}) took {compute:.3f} s on {worker}')
+        return '\n'.join(lines)
+
+def _merge_stages (target, source):
+    for path, (total, count) in source.items():
+        head_total, head_count = target.get(path, (0.0, 0))
+        target[path] = (head_total + total, head_count + count)
+
 # Helpers: transformation decorator
 #
 
@@ -36,14 +288,57 @@ def transform (transformer):
 
 # Helpers: compressed pickles
 #
+# The objects are pickled with protocol 5 and their (numpy) buffers are kept
+# out-of-band. The compressed stream holds a small header listing the buffer
+# sizes, the raw buffers themselves, and finally the pickle referencing them.
+# The buffers are written straight into the compressor and read back into
+# preallocated memory the resulting arrays then share, avoiding extra copies.
+#
+# Legacy files, holding a single in-band pickle, are loaded transparently.
+
+ZSTD_PICKLE_MAGIC = 'zstd-pickle-oob'
 
 def zstd_pickle_load (path):
     with zstd.open(path, 'rb') as file:
-        return pickle.load(file)
+        head = pickle.load(file)
+        if not _zstd_pickle_is_head(head):
+            return head
+        _, size_list = head
+        buffers = [ _zstd_read_buffer(file, size) for size in size_list ]
+        return pickle.load(file, buffers = buffers)
+
+def zstd_pickle_dump (path, what, level = 3, threads = -1):
+    # The threads argument follows zstandard, zero disables multi-threaded
+    # compression and negative values use all available cores.
+
+    buffers = []
+    payload = pickle.dumps(what, 
+        protocol = 5, 
+        buffer_callback = buffers.append)
+    size_list = [ buffer.raw().nbytes for buffer in buffers ]
 
-def zstd_pickle_dump (path, what):
-    with zstd.open(path, 'wb') as file:
-        pickle.dump(what, file)
+    cctx = zstd.ZstdCompressor(level = level, threads = threads)
+    with zstd.open(path, 'wb', cctx = cctx) as file:
+        pickle.dump((ZSTD_PICKLE_MAGIC, size_list), file, protocol = 5)
+        for buffer in buffers:
+            file.write(buffer.raw())
+        file.write(payload)
+
+def _zstd_pickle_is_head (head):
+    return (type(head) is tuple) and (len(head) == 2) \
+        and (type(head[0]) is str) and (head[0] == ZSTD_PICKLE_MAGIC)
+
+def _zstd_read_buffer (file, size):
+    # Numpy allocates aligned memory, the arrays are constructed on top of it.
+    buffer = np.empty(size, dtype = np.uint8)
+    view = memoryview(buffer)
+    offset = 0
+    while offset < size:
+        count = file.readinto(view[offset:])
+        if not count:
+            raise EOFError(f'Truncated buffer in {file}')
+        offset += count
+    return buffer
 
 def zstd_pickle_reader (path : str):
     with zstd.open(path, 'rb') as file:
@@ -77,10 +372,156 @@ class taskwrap:
         self._callable = callable
         self._head_args = head_args
     def __call__ (self, task_spec):
-        task_head, task_args = task_spec
+        # Optionally followed by keyword arguments, e.g. the retry attempt.
+        task_head, task_args, * task_opts = task_spec
+        task_kwargs = task_opts[0] if task_opts else {}
+        profiler.collect()
+        reset_peak_memory()
+        task_start = time.time()
         with (task_time := Stopwatch()):
-            task_data = self._callable(* self._head_args, * task_args)
-        return task_time(), task_spec, task_data
+            task_data = self._callable(* self._head_args, * task_args, ** task_kwargs)
+        task_exec = {
+            'worker' : worker_identity(),
+            'start' : task_start,
+            'end' : time.time(),
+            'time' : task_time(),
+            'memory' : peak_memory(),
+            'stages' : profiler.collect() }
+        return task_exec, task_spec, task_data
+
+# Helpers: local pools
+#
+# Stand-ins for mpi4py.futures.MPIPoolExecutor on a single machine without
+# MPI (benchmarks, small sweeps). Only its map method, optionally unordered,
+# and its submit method are used by the dispatcher.
+
+class SerialPool:
+    # (@) The tasks are computed as they are submitted, one at a time.
+    num_workers = 1
+    task_window = 1
+    def __enter__ (self):
+        return self
+    def __exit__ (self, * args):
+        pass
+    def map (self, fn, iterable, unordered = False):
+        return map(fn, iterable)
+    def submit (self, fn, * args):
+        future = cf.Future()
+        try:
+            future.set_result(fn(* args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+class LocalPool:
+    def __init__ (self, workers = None):
+        self.num_workers = workers or os.cpu_count()
+        self._executor = cf.ProcessPoolExecutor(self.num_workers)
+    def __enter__ (self):
+        return self
+    def __exit__ (self, * args):
+        self._executor.shutdown(cancel_futures = True)
+    def map (self, fn, iterable, unordered = False):
+        if not unordered:
+            return self._executor.map(fn, iterable)
+        futures = [ self._executor.submit(fn, item) for item in iterable ]
+        return (future.result() for future in cf.as_completed(futures))
+    def submit (self, fn, * args):
+        return self._executor.submit(fn, * args)
+    def restart (self):
+        # (@) A pool whose worker died (e.g. killed by the OOM killer) refuses
+        #     any task, it is replaced by a new one.
+        self._executor.shutdown(wait = False, cancel_futures = True)
+        self._executor = cf.ProcessPoolExecutor(self.num_workers)
+
+# Helpers: cost model
+#
+# The dispatcher processes the targets one after another, spreading the cells
+# of each target over the ranks. The wall time of a target is modelled as
+# ceil(cells / ranks) times the (mean) cost of its cells. The costs are
+# measured either by the dispatcher itself or by sampling a few cells of each
+# target ahead of the sweep (see master_target_estimator).
+
+class CostModel:
+    def __init__ (self, costs = None):
+        self.costs = dict(costs or {})
+
+    @classmethod
+    def load (cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def save (self, path):
+        with open(path, 'w') as file:
+            json.dump(self.costs, file, indent = 2)
+
+    def __contains__ (self, target):
+        return target in self.costs
+
+    def observe (self, target, seconds):
+        self.costs[target] = float(np.mean(seconds))
+
+    def cpu_time (self, target, cells):
+        return cells * self.costs[target]
+
+    def wall_time (self, target, cells, ranks):
+        return math.ceil(cells / ranks) * self.costs[target]
+
+    def report (self, target_cells, ranks):
+        '''
+        Tabulates the expected CPU and wall time of the targets, given as
+        a dictionary mapping their names to the numbers of cells.
+        '''
+
+        lines = [ f'{"target":24} {"cells":>8} {"cell [s]":>10} {"CPU [h]":>10} {"wall [h]":>10}' ]
+        cpu_total, wall_total = 0.0, 0.0
+        for target, cells in target_cells.items():
+            cpu = self.cpu_time(target, cells) / 3600
+            wall = self.wall_time(target, cells, ranks) / 3600
+            cpu_total, wall_total = cpu_total + cpu, wall_total + wall
+            lines.append(f'{target:24} {cells:8} {self.costs[target]:10.4f} {cpu:10.3f} {wall:10.3f}')
+        lines.append(f'{"total":24} {sum(target_cells.values()):8} {"":10} '
+            f'{cpu_total:10.3f} {wall_total:10.3f}')
+        lines.append(f'... wall time with {ranks} ranks')
+        return '\n'.join(lines)
+
+def master_target_estimator (zspace, pool,
+    worker,
+    target_name,
+    target_tail_list,
+    target_name_tail,
+    model,
+    cells = 3,
+    seed = 0,
+    ** target_args):
+
+    # Dry run of master_target_dispatcher, computes a few cells of each target
+    # (at random, yet reproducible, positions) and records their mean cost
+    # into the model. Nothing is stored. Returns a dictionary mapping the
+    # names of the targets to their numbers of cells.
+
+    zshape = zspace.size, zspace.size
+    rng = np.random.default_rng(seed)
+
+    target_cells = {}
+    for task_tail in target_tail_list:
+        task_tail = make_tuple_like(task_tail)
+        file_name = make_file_name(target_name, target_name_tail, task_tail)
+
+        picks = rng.choice(zspace.size ** 2, 
+            size = min(cells, zspace.size ** 2), replace = False)
+        task_list = [ make_task_spec(zspace, * np.unravel_index(pick, zshape), * task_tail)
+            for pick in picks ]
+
+        print(f'Estimating {file_name}')
+        model.observe(file_name, [ task_exec['time'] 
+            for task_exec, task_spec, task_data 
+            in pool.map(worker, task_list, unordered = 1) ])
+        target_cells[file_name] = zspace.size ** 2
+
+    return target_cells
 
 # Helpers: dispatchers
 #
@@ -93,45 +534,322 @@ def make_tuple_like (what):
 def make_task_spec (zspace, i1, i2, * tail_args):
     return (i1, i2), (zspace[i1], zspace[i2], * tail_args)
 
+def make_file_name (target_name, target_name_tail, task_tail):
+    file_tail = target_name_tail.format(* task_tail)
+    return f'{target_name}_{file_tail}' if file_tail else target_name
+
 def master_target_dispatcher (zspace, pool, 
     worker, 
     target_name, 
     target_tail_list,
-    target_name_tail):
+    target_name_tail,
+    result_format = 'pickle',
+    result_outputs = None,
+    cache = None,
+    cache_params = None,
+    result_path = 'result',
+    model = None,
+    shard = None,
+    task_retries = 3,
+    task_timeout = None):
+
+    # The results are either gathered in memory and stored as a single
+    # compressed pickle, or written incrementally, tile by tile, as the
+    # individual cells arrive (see tilestore module).
+    #
+    # Workers either return the result of the cell, or a dictionary of named
+    # outputs described by result_outputs, mapping their names to the shape
+    # of a cell and the tile size. The output named 'result' is stored under
+    # the target name, the others get their name appended. Outputs named by
+    # pairs (file_name, output_name) are stored under the given file name
+    # instead, a single worker can thus produce several targets at once.
+    #
+    # With a cache (see resultcache module), the cells computed previously
+    # with the same parameters (cache_params) and code are not recomputed.
+    #
+    # With a cost model, the expected duration of each target is shown and
+    # the measured costs of its cells are recorded into the model.
+    #
+    # With a shard (index, count), only the cells of the grid belonging to the
+    # shard are computed (see shard_cells), the results of the shards are 
+    # merged afterwards (see mergeshards module).
+    #
+    # Failed tasks are resubmitted, up to task_retries times, with the attempt
+    # passed to the worker (e.g. to reduce its memory footprint). Tasks running
+    # longer than task_timeout seconds are resubmitted as well, the first
+    # result wins. Cells failing repeatedly are filled with NaN and recorded
+    # (see execute_tasks) instead of aborting the sweep.
 
     # Wrap me like a burrito.
     zshape = zspace.size, zspace.size
-    result = np.zeros(shape = (* zshape, 6), dtype = np.float64)
+    result_outputs = result_outputs or { 'result' : ((6, ), 64) }
 
     for task_tail in target_tail_list:
         task_tail = make_tuple_like(task_tail)
         task_list = [ make_task_spec(zspace, * ix, * task_tail) for ix in np.ndindex(zshape) ]
-        task_size = len(task_list)
+        if shard is not None:
+            cells = shard_cells(zspace.size, * shard, 
+                block = math.lcm(* (output_tile for output_shape, output_tile 
+                    in result_outputs.values())))
+            task_list = [ task_spec for task_spec in task_list 
+                if cells[task_spec[0]] ]
+        task_total = len(task_list)
+
+        file_name = make_file_name(target_name, target_name_tail, task_tail)
 
-        file_tail = target_name_tail.format(* task_tail)
-        file_name = f'{target_name}_{file_tail}'
+        outputs = {
+            output_name : ResultOutput(
+                make_output_path(result_path, file_name, output_name), 
+                shape = (* zshape, * output_shape),
+                tile = output_tile,
+                result_format = result_format)
+            for output_name, (output_shape, output_tile) 
+            in result_outputs.items() }
+
+        def result_put (task_head, task_data):
+            if not isinstance(task_data, dict):
+                task_data = { 'result' : task_data }
+            for output_name, output in outputs.items():
+                output.put(task_head, task_data[output_name])
+
+        if cache is not None:
+            digest = cache.target_digest(
+                target = target_name, tail = task_tail, ** (cache_params or {}))
+            task_keys = { 
+                task_head : cache.cell_key(digest, * task_args[:2])
+                for task_head, task_args in task_list }
+            task_hits = cache.get(task_keys.values())
+            for task_head, task_args in task_list:
+                if task_keys[task_head] in task_hits:
+                    result_put(task_head, task_hits[task_keys[task_head]])
+            task_list = [ task_spec for task_spec in task_list
+                if task_keys[task_spec[0]] not in task_hits ]
+
+        task_size = len(task_list)
 
         print(f'Processing {file_name}')
-        with make_tqdm_progress(task_size) as progress:
-            for task_pack in pool.map(worker, task_list, unordered = 1):
-                task_exec, task_spec, task_data = task_pack
-                task_head, task_args = task_spec
-                result[task_head] = task_data
-                progress.update(1)
-
-        # with (runtime := Stopwatch()):
-        #     for task_pack in pool.map(worker, task_list, unordered = 1):
-        #         task_exec, task_spec, task_data = task_pack
-        #         task_head, task_args = task_spec
-        #         result[task_head, ...] = task_data
-        # print(f'=> {target_name} with {task_tail} took {runtime():.4f} total')
-
-        file_path = f'result/{file_name}.pickle.zstd'
-        zstd_pickle_dump(file_path, result)
+        if shard is not None:
+            print(f'... shard {shard[0]} of {shard[1]}, {task_total} cells')
+        if task_size < task_total:
+            print(f'... {task_total - task_size} cells cached')
+        ranks = getattr(pool, 'num_workers', None)
+        if (model is not None) and (file_name in model) and ranks:
+            print(f'... expected {model.wall_time(file_name, task_size, ranks):.1f} s'
+                f' on {ranks} ranks')
+
+        report = TimingReport(file_name)
+        telemetry = Telemetry(file_name)
+        failures = {}
+        with (runtime := Stopwatch()):
+            with make_tqdm_progress(task_size) as progress:
+                for task_pack in execute_tasks(pool, worker, task_list, failures,
+                    retries = task_retries, timeout = task_timeout):
+                    task_exec, task_spec, task_data = task_pack
+                    task_head, task_args, * task_opts = task_spec
+                    telemetry.add(task_head, task_exec, time.time())
+                    result_put(task_head, task_data)
+                    report.add(task_exec)
+                    if cache is not None:
+                        cache.put(task_keys[task_head], task_data)
+                    progress.update(1)
+        report.wall = runtime()
+
+        # Failed cells are left undetermined (NaN) and recorded.
+        if failures:
+            for task_head in failures:
+                result_put(task_head, { output_name : np.full(output_shape, np.nan)
+                    for output_name, (output_shape, output_tile) in result_outputs.items() })
+            with open(f'{result_path}/{file_name}.failed.json', 'w') as file:
+                json.dump([ { 'cell' : task_head, ** failure } 
+                    for task_head, failure in failures.items() ], file, indent = 2)
+            print(f'... {len(failures)} cells failed, see {file_name}.failed.json')
+
+        if cache is not None:
+            cache.commit()
+
+        # The timing report and the telemetry are written next to the results.
+        if task_size:
+            if model is not None:
+                model.observe(file_name, telemetry.table()['compute'])
+            report.write(f'{result_path}/{file_name}.timing.json')
+            telemetry.write(f'{result_path}/{file_name}.telemetry.pickle.zstd')
+            print(report)
+            print(telemetry)
+
+        for output in outputs.values():
+            output.close()
+
+def execute_tasks (pool, worker, task_list, failures, 
+    retries = 3, timeout = None, poll = 1.0, window = None):
+    '''
+    Submits the tasks to the pool and yields their results as they arrive.
+
+    At most window tasks (twice the workers of the pool by default, see 
+    task_window) are in flight at once, the others are submitted as the
+    results arrive.
+
+    A task raising an exception is resubmitted with the attempt (counted
+    from zero) passed to the worker as a keyword argument. A task running
+    for more than timeout seconds (from the moment the pool starts it) is
+    resubmitted alongside, the first result is taken. Tasks failing after
+    the retries are recorded into failures, mapping their heads to the
+    task arguments, the number of attempts and the errors.
+
+    The abandoned attempts are not killed. A hung attempt keeps its worker
+    and still blocks the shutdown of the pool at the end of the sweep, the
+    timeout only keeps the other tasks going. The serial pool computes the 
+    tasks as they are submitted, the timeout does not apply to it.
+
+    A pool broken by a dead worker (e.g. killed for running out of memory)
+    is restarted, if it can be (see LocalPool.restart). The attempts pending
+    within the broken pool fail, whichever of them killed the worker, and 
+    are retried as any other failed attempts.
+    '''
+
+    window = task_window(pool) if window is None else window
+
+    # Each pending future maps to [ task_spec, attempt, started ], started
+    # being None until the pool starts the task and inf once it timed out.
+    # The retried attempts are submitted ahead of the waiting tasks.
+    pending, waiting, retried = {}, iter(task_list), collections.deque()
+    done_heads, attempts, errors = set(), {}, {}
+
+    def submit (task_spec, attempt):
+        task_head, task_args = task_spec[:2]
+        if attempt:
+            task_spec = (task_head, task_args, { 'attempt' : attempt })
+        try:
+            future = pool.submit(worker, task_spec)
+        except cf.BrokenExecutor:
+            if not hasattr(pool, 'restart'):
+                raise
+            pool.restart()
+            future = pool.submit(worker, task_spec)
+        pending[future] = [ task_spec, attempt, None ]
+
+    def refill ():
+        # (@) The abandoned attempts do not count against the window.
+        live = sum(started != math.inf for _, _, started in pending.values())
+        for _ in range(window - live):
+            if retried:
+                submit(* retried.popleft())
+                continue
+            task_spec = next(waiting, None)
+            if task_spec is None:
+                return
+            submit(task_spec, 0)
+
+    def retry (task_spec, attempt, error):
+        task_head = task_spec[0]
+        errors.setdefault(task_head, []).append(error)
+        attempts[task_head] = max(attempts.get(task_head, 0), attempt + 1)
+        if attempts[task_head] <= retries:
+            return retried.append((task_spec, attempts[task_head]))
+
+        # Given up once no attempt of the task is alive.
+        alive = any((spec[0] == task_head) and (started != math.inf)
+            for spec, _, started in pending.values())
+        if not alive:
+            done_heads.add(task_head)
+            failures[task_head] = { 
+                'args' : [ float(arg) for arg in task_spec[1] ],
+                'attempts' : attempts[task_head],
+                'errors' : errors[task_head] }
+
+    refill()
+    while pending:
+        done, _ = cf.wait(pending, timeout = poll, return_when = cf.FIRST_COMPLETED)
+
+        for future in done:
+            task_spec, attempt, started = pending.pop(future)
+            if task_spec[0] in done_heads:
+                continue
+            try:
+                task_pack = future.result()
+            except Exception as error:
+                # (@) Timed out attempts were already retried.
+                if started != math.inf:
+                    retry(task_spec, attempt, f'{type(error).__name__}: {error}')
+                continue
+            done_heads.add(task_spec[0])
+            yield task_pack
+
+        # (@) Hung workers are not killed, their tasks are duplicated.
+        now = time.monotonic()
+        for future, entry in list(pending.items()):
+            task_spec, attempt, started = entry
+            if (started is None) and future.running():
+                entry[2] = started = now
+            if (timeout is not None) and (started is not None) and \
+                (now - started > timeout) and (task_spec[0] not in done_heads):
+                entry[2] = math.inf
+                retry(task_spec, attempt, f'Timeout after {timeout} s')
+
+        # Remaining attempts of the finished (or failed) tasks are abandoned.
+        for future, (task_spec, attempt, started) in list(pending.items()):
+            if task_spec[0] in done_heads:
+                future.cancel()
+                pending.pop(future)
+
+        refill()
+
+def task_window (pool):
+    # Twice the workers keep them busy while the results are being processed.
+    if hasattr(pool, 'task_window'):
+        return pool.task_window
+    return 2 * (getattr(pool, 'num_workers', None) or os.cpu_count() or 1)
+
+def shard_cells (size, index, count, block = 1):
+    '''
+    Returns a boolean mask of the grid cells belonging to a shard, shape 
+    (size, size). The grid is split into square blocks (aligned with the
+    tiles of the results), the blocks are dealt to the shards in turn. 
+    Raises ValueError if there are fewer blocks than shards.
+    '''
+
+    blocks = - (- size // block)
+    if count > blocks ** 2:
+        raise ValueError(f'{count} shards of {blocks ** 2} blocks of the grid')
+    b = np.arange(size) // block
+    return (b[:, np.newaxis] * blocks + b[np.newaxis, :]) % count == index
+
+def make_output_path (result_path, file_name, output_name):
+    # Outputs named by pairs (file_name, output_name) belong to other files.
+    if isinstance(output_name, tuple):
+        file_name, output_name = output_name
+    if output_name == 'result':
+        return f'{result_path}/{file_name}'
+    return f'{result_path}/{file_name}.{output_name}'
+
+class ResultOutput:
+    def __init__ (self, path, shape, tile, result_format):
+        self._path = path
+        self._format = result_format
+        if result_format == 'tiles':
+            self._data = TileStore.create(path + TILESTORE_SUFFIX, shape,
+                tile = (tile, tile),
+                attrs = { 'target' : os.path.basename(path) })
+        elif result_format == 'pickle':
+            self._data = np.zeros(shape = shape, dtype = np.float64)
+        else:
+            raise ValueError(f'Unknown result format {result_format}')
+
+    def put (self, task_head, task_data):
+        if self._format == 'tiles':
+            self._data.put(* task_head, task_data)
+        else:
+            self._data[task_head] = task_data
+
+    def close (self):
+        if self._format == 'tiles':
+            self._data.close()
+        else:
+            zstd_pickle_dump(f'{self._path}.pickle.zstd', self._data)
 
 def make_tqdm_progress (total):
     return tqdm.tqdm(
-        bar_format = '[{bar}] ({n_fmt:4} of {total_fmt:4}) took {elapsed_s:8.3f}',
+        bar_format = '[{bar}] ({n_fmt:4} of {total_fmt:4}) took {elapsed_s:8.3f} at {rate_fmt}',
+        unit = 'cell',
         total = total,
         ascii = 0, 
         ncols = 80)
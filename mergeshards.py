@@ -0,0 +1,173 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module implements merging of sharded sweeps. Please refer to the
+# documentation strings of the functions for details.
+#
+# A sweep can be split into independent shards (see --shard of the unified
+# simulation), e.g. the jobs of a job array, computing the tiles of the grid
+# dealt to them (see helpers.shard_cells) without any communication. Each shard
+# stores partial tile stores within its own directory,
+#
+#   result.10dB.1001/shard.0007-of-0128/pnrd_pnrd_04.tiles
+#
+# Merging validates that the shards cover the whole grid, exactly once, and
+# assembles the complete targets within the sweep directory.
+#
+# Example
+#
+#   python mergeshards.py unified/result.10dB.1001
+#   python mergeshards.py unified/result.10dB.1001 --format tiles
+
+import os
+import re
+import glob
+import argparse
+
+import numpy as np
+
+from helpers import zstd_pickle_load, zstd_pickle_dump
+from tilestore import TileStore, TILESTORE_SUFFIX
+
+SHARD_PATTERN = 'shard.{:04}-of-{:04}'
+SHARD_REGEX = re.compile(r'shard\.(\d+)-of-(\d+)$')
+
+def shard_path (result_path, index, count):
+    return os.path.join(result_path, SHARD_PATTERN.format(index, count))
+
+def parse_shard (text):
+    '''
+    Parses the shard specification I/N, the I-th of N shards (from zero).
+    '''
+
+    try:
+        index, count = map(int, text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid shard {text}, expected I/N')
+    if not (0 <= index < count):
+        raise argparse.ArgumentTypeError(f'Invalid shard {text}, expected 0 <= I < N')
+    return index, count
+
+def find_shards (result_path):
+    '''
+    Finds the shard directories of a sweep, returns a dictionary mapping the
+    indices of the shards to their paths. Raises ValueError if the shards
+    are incomplete or come from different splits.
+    '''
+
+    shards, counts = {}, set()
+    for path in sorted(glob.glob(os.path.join(result_path, 'shard.*'))):
+        match = SHARD_REGEX.search(path)
+        if match and os.path.isdir(path):
+            index, count = map(int, match.groups())
+            shards[index] = path
+            counts.add(count)
+
+    if not shards:
+        raise ValueError(f'No shards within {result_path}')
+    if len(counts) > 1:
+        raise ValueError(f'Shards of different splits {sorted(counts)} within {result_path}')
+
+    count, = counts
+    missing = sorted(set(range(count)) - set(shards))
+    if missing:
+        raise ValueError(f'Missing shards {missing} of {count} within {result_path}')
+    return shards
+
+def merge_target (shard_list, target, output, result_format = 'pickle', level = 3):
+    '''
+    Merges the partial tile stores of a target.
+
+    Parameters
+    ----------
+    shard_list : list
+        Paths to the shard directories.
+    target : str
+        Name of the target, e.g. pnrd_pnrd_04 or pnrd_pnrd_04.stats.
+    output : str
+        Path of the merged target, without the suffix.
+    result_format : str
+        Either 'pickle' (a single array) or 'tiles' (a tile store).
+    level : int
+        Compression level of the merged tile store.
+    '''
+
+    stores = [ TileStore.open(os.path.join(path, target + TILESTORE_SUFFIX))
+        for path in shard_list ]
+    try:
+        head = stores[0]
+        for store in stores[1:]:
+            if (store.shape, store.dtype, store.tile) != (head.shape, head.dtype, head.tile):
+                raise ValueError(f'{target}: shards of different layouts')
+
+        # Each tile must be written by exactly one shard.
+        coverage = np.sum([ [ [ store.has_tile(t1, t2)
+            for t2 in range(head.tile_count[1]) ]
+            for t1 in range(head.tile_count[0]) ] for store in stores ], axis = 0)
+        if np.any(coverage == 0):
+            raise ValueError(f'{target}: {np.sum(coverage == 0)} tiles not covered')
+        if np.any(coverage > 1):
+            raise ValueError(f'{target}: {np.sum(coverage > 1)} tiles covered repeatedly')
+
+        if result_format == 'pickle':
+            data = np.empty(head.shape, dtype = head.dtype)
+            for store in stores:
+                for t1, t2 in np.ndindex(store.tile_count):
+                    if store.has_tile(t1, t2):
+                        (a1, b1), (a2, b2) = store.tile_bounds(t1, t2)
+                        data[a1:b1, a2:b2] = store.read_tile(t1, t2)
+            zstd_pickle_dump(output + '.pickle.zstd', data)
+        elif result_format == 'tiles':
+            with TileStore.create(output + TILESTORE_SUFFIX, head.shape, head.tile,
+                dtype = head.dtype, level = level, attrs = head.attrs) as merged:
+                for store in stores:
+                    for t1, t2 in np.ndindex(store.tile_count):
+                        if store.has_tile(t1, t2):
+                            merged.write_tile(t1, t2, store.read_tile(t1, t2))
+        else:
+            raise ValueError(f'Unknown result format {result_format}')
+    finally:
+        for store in stores:
+            store.close()
+
+def merge_shards (result_path, result_format = 'pickle', level = 3):
+    '''
+    Merges all the targets of a sharded sweep into the sweep directory.
+    Returns the list of the merged targets.
+    '''
+
+    shards = find_shards(result_path)
+    shard_list = [ shards[index] for index in sorted(shards) ]
+
+    # The grids must be the same for all the shards.
+    for name in [ 'rspace', 'zspace' ]:
+        spaces = [ zstd_pickle_load(os.path.join(path, f'{name}.pickle.zstd'))
+            for path in shard_list ]
+        if not all(np.array_equal(space, spaces[0]) for space in spaces):
+            raise ValueError(f'Shards of different {name} within {result_path}')
+        zstd_pickle_dump(os.path.join(result_path, f'{name}.pickle.zstd'), spaces[0])
+
+    target_list = sorted({
+        os.path.basename(path).removesuffix(TILESTORE_SUFFIX)
+        for shard in shard_list
+        for path in glob.glob(os.path.join(shard, '*' + TILESTORE_SUFFIX)) })
+    for target in target_list:
+        print(f'Merging {target}')
+        merge_target(shard_list, target, os.path.join(result_path, target),
+            result_format = result_format, level = level)
+    return target_list
+
+if (__name__ == '__main__'):
+    parser = argparse.ArgumentParser(
+        description = 'Merges the shards of a sweep.')
+    parser.add_argument('result_path',
+        help = 'directory of the sweep, containing the shard directories')
+    parser.add_argument('--format', default = 'pickle',
+        choices = [ 'pickle', 'tiles' ],
+        help = 'format of the merged targets')
+    parser.add_argument('--level', type = int, default = 3,
+        help = 'compression level of the merged tile stores')
+    args = parser.parse_args()
+
+    target_list = merge_shards(args.result_path,
+        result_format = args.format, level = args.level)
+    print(f'Merged {len(target_list)} targets into {args.result_path}')
@@ -0,0 +1,91 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module implements re-certification of the simulated states from their
+# stored per-rate sufficient statistics (see DEF_RESULT_STATS in the unified
+# simulation). The optimal squeezing rates are recomputed under different
+# certification factors, event count thresholds, or threshold curves, without
+# resimulating the states.
+#
+# Example
+#
+#   python recertify.py unified.result pnrd_pnrd_04 --level 4 --x-mul 5
+
+import os
+import argparse
+
+import numpy as np
+
+from stellar import threshold_curve
+from certify import certified_optimum
+from helpers import zstd_pickle_load, zstd_pickle_dump
+from tilestore import open_result
+
+def recertify (Rv, stats, level, 
+    x_mul = 3.0, y_mul = 3.0, min_count = 1000, 
+    curve = None, block = 16):
+    '''
+    Recomputes the optimal states of all the cells under new criteria.
+
+    Parameters
+    ----------
+    Rv : np.ndarray
+        Squeezing rates, shape (R, ).
+    stats : np.ndarray | tilestore.TileStore
+        Per-rate sufficient statistics, shape (N, N, R, 6).
+        See certify.certified_optimum for details.
+    level : int
+        Level of the hierarchy the statistics were computed for.
+    x_mul : float
+    y_mul : float
+        Certification factors.
+    min_count : float
+        Minimal count of successful heralding events.
+    curve : scipy.interpolate.CubicSpline
+        Threshold curve, defaults to the curve of the given level.
+    block : int
+        Number of rows of the grid processed at once.
+
+    Returns
+    -------
+    np.ndarray
+        The recomputed results of shape (N, N, 6), see results/README.
+    '''
+
+    if curve is None:
+        curve = threshold_curve(level)
+
+    N1, N2 = stats.shape[:2]
+    result = np.empty(shape = (N1, N2, 6), dtype = np.float64)
+    for offset in range(0, N1, block):
+        result[offset:(offset + block)] = certified_optimum(Rv, 
+            stats[offset:(offset + block)], curve,
+            x_mul = x_mul, y_mul = y_mul, min_count = min_count)
+    return result
+
+if (__name__ == '__main__'):
+    parser = argparse.ArgumentParser(
+        description = 'Recertifies results from their sufficient statistics.')
+    parser.add_argument('base', 
+        help = 'directory with the results')
+    parser.add_argument('target', 
+        help = 'target name, e.g. pnrd_pnrd_04')
+    parser.add_argument('--level', type = int, required = True)
+    parser.add_argument('--x-mul', type = float, default = 3.0)
+    parser.add_argument('--y-mul', type = float, default = 3.0)
+    parser.add_argument('--min-count', type = float, default = 1000)
+    parser.add_argument('--output', 
+        help = 'output path, derived from the criteria by default')
+    args = parser.parse_args()
+
+    Rv = zstd_pickle_load(os.path.join(args.base, 'rspace.pickle.zstd'))
+    stats = open_result(os.path.join(args.base, f'{args.target}.stats'))
+    result = recertify(Rv, stats, args.level, 
+        x_mul = args.x_mul, y_mul = args.y_mul, min_count = args.min_count)
+
+    output = args.output or os.path.join(args.base, 
+        f'{args.target}.recertified_{args.x_mul:g}_{args.y_mul:g}'
+        f'_{args.min_count:g}.pickle.zstd')
+    zstd_pickle_dump(output, result)
+
+    print(f'Certified {np.isfinite(result[..., 0]).sum()} of '
+        f'{result[..., 0].size} cells, written to {output}')
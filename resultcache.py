@@ -0,0 +1,132 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module implements a content-addressed cache of the simulation results.
+# Please refer to the documentation strings of the classes and functions for
+# details.
+#
+# Each cell of a target is stored under a hash of everything its result
+# depends on: the parameters of the simulation (sampling rates, dimensions,
+# squeezing rates, detector configuration, ...), the transmission rates of
+# the cell, and the source code of the circuit and certification procedures.
+# Changing a parameter only invalidates the cells that actually depend on it,
+# and cells shared by different sweeps (e.g. coinciding transmission rates of
+# different grids) are computed only once.
+
+import pickle
+import sqlite3
+import inspect
+import hashlib
+
+import numpy as np
+
+class ResultCache:
+    '''
+    Persistent cache of per-cell results, backed by a sqlite database.
+    Only the master process accesses the cache.
+
+    Parameters
+    ----------
+    path : str
+        Path to the database, created if necessary.
+    code : list
+        Modules and functions whose source code determines the results.
+        Any change of their source invalidates the cached results.
+    '''
+
+    def __init__ (self, path, code = ()):
+        self._path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cells (key TEXT PRIMARY KEY, value BLOB)')
+        self._db.commit()
+
+        self.code_digest = code_digest(code)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, * args):
+        self.close()
+
+    def close (self):
+        self._db.commit()
+        self._db.close()
+
+    def target_digest (self, ** params):
+        '''
+        Digest of the target parameters (and the code version).
+        '''
+
+        digest = hashlib.sha256(self.code_digest.encode())
+        _digest_update(digest, params)
+        return digest.hexdigest()
+
+    def cell_key (self, target_digest, z1, z2):
+        '''
+        Key of a single cell. The transmission rates are rounded, so that
+        coinciding rates of different grids share their keys.
+        '''
+
+        return hashlib.sha256(
+            f'{target_digest}:{z1:.12g}:{z2:.12g}'.encode()).hexdigest()
+
+    def get (self, key_list):
+        '''
+        Retrieves the cached values, returns a dictionary of the found keys.
+        '''
+
+        found = {}
+        key_list = list(key_list)
+        for offset in range(0, len(key_list), 512):
+            keys = key_list[offset:(offset + 512)]
+            rows = self._db.execute(
+                'SELECT key, value FROM cells WHERE key IN ({})'.format(
+                    ', '.join('?' * len(keys))), keys)
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+        return found
+
+    def put (self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO cells VALUES (?, ?)',
+            (key, pickle.dumps(value, protocol = 5)))
+
+    def commit (self):
+        self._db.commit()
+
+def code_digest (code):
+    '''
+    Digest of the source code of the given modules and functions.
+    '''
+
+    digest = hashlib.sha256()
+    for item in code:
+        digest.update(inspect.getsource(item).encode())
+    return digest.hexdigest()
+
+def _digest_update (digest, what):
+    # Canonical, type-tagged serialization of the parameters.
+    if isinstance(what, dict):
+        digest.update(b'd')
+        for key in sorted(what):
+            _digest_update(digest, key)
+            _digest_update(digest, what[key])
+    elif isinstance(what, (list, tuple)):
+        digest.update(f'l{len(what)}'.encode())
+        for item in what:
+            _digest_update(digest, item)
+    elif isinstance(what, np.ndarray):
+        what = np.ascontiguousarray(what)
+        digest.update(f'a{what.dtype.str}{what.shape}'.encode())
+        digest.update(what.tobytes())
+    elif isinstance(what, (float, np.floating)):
+        digest.update(f'f{float(what)!r}'.encode())
+    elif isinstance(what, (bool, np.bool_)):
+        digest.update(f'b{bool(what)}'.encode())
+    elif isinstance(what, (int, np.integer)):
+        digest.update(f'i{int(what)}'.encode())
+    elif isinstance(what, str):
+        digest.update(f's{len(what)}:{what}'.encode())
+    elif what is None:
+        digest.update(b'n')
+    else:
+        raise TypeError(f'Cannot digest {type(what)}')
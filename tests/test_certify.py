@@ -0,0 +1,53 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import pytest
+import numpy as np
+from stellar import threshold_curve
+from certify import threshold_curve_certify
+from certify import threshold_curve_certify_vectorized
+from certify import certified_optimum
+
+@pytest.mark.parametrize('level', [ 3, 4, 5 ])
+@pytest.mark.parametrize('mul', [ 2.0, 3.0 ])
+def test_threshold_curve_certify_vectorized (level, mul):
+    '''
+    Compares the vectorized certification with the reference implementation
+    on random uncertainty rectangles, including those partially outside the
+    domain of the curve and those with negative bottom edges.
+    '''
+
+    rng = np.random.default_rng(level)
+    size = 500
+    x_avg = rng.uniform(-0.1, 1.1, size)
+    x_std = rng.exponential(0.02, size)
+    y_avg = rng.uniform(-0.05, 0.8, size)
+    y_std = rng.exponential(0.02, size)
+
+    curve = threshold_curve(level)
+    expect = threshold_curve_certify(curve, x_avg, x_std, mul, y_avg, y_std, mul)
+    result = threshold_curve_certify_vectorized(curve, x_avg, x_std, mul, y_avg, y_std, mul)
+
+    assert np.array_equal(expect, result)
+
+def test_certified_optimum ():
+    '''
+    The optimum maximizes the probability of success among the certified
+    rates with sufficient counts, NaN if there are none.
+    '''
+
+    Rv = np.linspace(0.1, 1.0, 4)
+    stats = np.array([
+        # Ps, Cs, aX, sX, aY, sY
+        [ [ 0.1, 1e4, 0.01, 0.001, 0.70, 0.01 ],  # certified
+          [ 0.3, 1e4, 0.02, 0.001, 0.70, 0.01 ],  # certified, optimal
+          [ 0.4, 1e2, 0.02, 0.001, 0.70, 0.01 ],  # insufficient count
+          [ 0.5, 1e4, 0.20, 0.001, 0.30, 0.01 ] ],# not certified
+        [ [ 0.5, 1e4, 0.20, 0.001, 0.30, 0.01 ] ] * 4
+    ])
+
+    result = certified_optimum(Rv, stats, threshold_curve(4), 3, 3, 1000)
+
+    assert result.shape == (2, 6)
+    assert np.array_equal(result[0], [ 0.3, Rv[1], 0.02, 0.001, 0.70, 0.01 ])
+    assert np.all(np.isnan(result[1]))
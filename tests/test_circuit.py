@@ -5,6 +5,12 @@ import pytest
 import numpy as np
 import scipy.special as ss
 from circuit import evaluate_circuit_pnrd_pnrd
+from circuit import evaluate_circuit_capd_pnrd
+from circuit import evaluate_circuit_adaptive
+from circuit import CircuitWorkspace
+from circuit import evaluate_circuit_shared
+from circuit import evaluate_circuit_fast
+from circuit import circuit_hyp2f1
 
 def fock_kraus_loss (z, d):
     A = np.zeros(shape = (d, d, d))
@@ -63,3 +69,155 @@ def test_evaluate_circuit (r, m, z1, z2):
     assert np.abs(Ps - Os) < 1e-8
     assert np.abs(Pn - On).max() < 1e-8
 
+
+@pytest.mark.parametrize('m', [ 3, 4, 5 ])
+def test_evaluate_circuit_tail (m):
+    '''
+    The tail mode computes the leading coefficients and the exact remaining
+    probability, for both the heralding detectors.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, m, 200)
+    Qs, Qn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, m, m + 1, tail = True)
+    assert np.allclose(Ps, Qs)
+    assert np.allclose(Pn[:, :m + 1], Qn[:, :m + 1])
+    assert np.allclose(Pn[:, m + 1:].sum(axis = -1), Qn[:, -1])
+
+    Ps, Pn = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, m, 10, 40, 200)
+    Qs, Qn = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, m, 10, 40, m + 1, tail = True)
+    assert np.allclose(Ps, Qs)
+    assert np.allclose(Pn[:, m + 1:].sum(axis = -1), Qn[:, -1])
+
+@pytest.mark.parametrize('tol', [ 1e-6, 1e-10 ])
+def test_evaluate_circuit_adaptive (tol):
+    '''
+    The adaptive dimension is the least one keeping the truncation error 
+    within the tolerance, the computed coefficients coincide with the fixed
+    dimension ones.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    Ps, Pn, error = evaluate_circuit_adaptive(Rv, 0.7, 0.8, 4, tol)
+    Qs, Qn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, 4, 200)
+    assert error.max() <= tol
+    assert Qn[:, Pn.shape[-1] - 1:].sum(axis = -1).max() > tol
+    assert np.allclose(Ps, Qs)
+    assert np.allclose(Pn, Qn[:, :Pn.shape[-1]])
+    assert np.allclose(error, Qn[:, Pn.shape[-1]:].sum(axis = -1))
+
+    Ps, Pn, error = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, 4, 10, 20, 6, 
+        tol = tol)
+    assert error.max() <= tol
+    assert np.allclose(Pn.sum(axis = -1) + error, 1.0)
+    assert (1.0 - Pn[:, :-1].sum(axis = -1)).max() > tol
+
+    # Weak squeezing needs only a few coefficients beyond the initial ones.
+    Ps, Pn, error = evaluate_circuit_adaptive(Rv[:5], 0.7, 0.8, 4, tol)
+    assert error.max() <= tol
+    assert Pn.shape[-1] < 10
+
+@pytest.mark.parametrize('tail', [ False, True ])
+def test_evaluate_circuit_workspace (tail):
+    '''
+    The circuits evaluated within a reused workspace and output buffer 
+    coincide with the plain ones.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    W = CircuitWorkspace(Rv)
+    out = W.buffer('result', 20 + tail)
+    for m in [ 3, 4 ]:
+        Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, m, 20, tail)
+        Qs, Qn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, m, 20, tail,
+            out = out, workspace = W)
+        assert np.shares_memory(Qn, out)
+        assert np.allclose(Ps, Qs) and np.allclose(Pn, Qn)
+
+        Ps, Pn = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, m, 10, 40, 20, 
+            tail = tail)
+        Qs, Qn = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, m, 10, 40, 20, 
+            tail = tail, out = out, workspace = W)
+        assert np.shares_memory(Qn, out)
+        assert np.allclose(Ps, Qs) and np.allclose(Pn, Qn)
+
+@pytest.mark.parametrize('z1, z2', [ (0.5, 0.5), (0.9, 0.9) ])
+def test_evaluate_circuit_workspace_allocations (z1, z2):
+    '''
+    The circuits evaluated within a reused workspace and output buffer
+    allocate no arrays of the size of their results, neither through the
+    power series (weak squeezing) nor the general evaluation.
+    '''
+
+    import tracemalloc
+
+    Rv = np.linspace(0.00115, 1.15, 10000)
+    W = CircuitWorkspace(Rv)
+    for m, out in [ (4, W.buffer('result', 20)), 
+        (np.arange(8), W.buffer('stacked', 20, 8)) ]:
+        evaluate_circuit_fast(Rv, z1, z2, m, 20, out = out, workspace = W)
+        tracemalloc.start()
+        try:
+            evaluate_circuit_fast(Rv, z1, z2, m, 20, out = out, workspace = W)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < out.nbytes / 2
+
+def test_evaluate_circuit_workspace_mismatch ():
+    '''
+    The workspace of other squeezing rates is rejected.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    W = CircuitWorkspace(Rv)
+    with pytest.raises(ValueError):
+        evaluate_circuit_pnrd_pnrd(2 * Rv, 0.7, 0.8, 4, 20, workspace = W)
+    with pytest.raises(ValueError):
+        evaluate_circuit_capd_pnrd(Rv[:10], 0.7, 0.8, 4, 10, 40, 20, workspace = W)
+
+def test_evaluate_circuit_shared ():
+    '''
+    The circuits evaluated from the shared terms coincide with the ones
+    evaluated separately, the CAPD mixtures (of several blocks of the terms)
+    exactly.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    capd_list = [ (3, 10), (4, 10), (4, 20) ]
+    pnrd, capd = evaluate_circuit_shared(Rv, 0.7, 0.8, 8, [ 3, 5 ], capd_list, 40)
+    assert sorted(pnrd) == [ 3, 5 ] and sorted(capd) == capd_list
+
+    for m, (Qs, Qn) in pnrd.items():
+        Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, 0.7, 0.8, m, 8)
+        assert np.allclose(Ps, Qs) and np.allclose(Pn, Qn)
+    for (m, M), (Qs, Qn) in capd.items():
+        Ps, Pn = evaluate_circuit_capd_pnrd(Rv, 0.7, 0.8, m, M, 40, 8)
+        assert np.array_equal(Ps, Qs) and np.array_equal(Pn, Qn)
+
+@pytest.mark.parametrize('z1, z2', [ (0.7, 0.8), (1.0, 1.0) ])
+def test_evaluate_circuit_stacked (z1, z2):
+    '''
+    Several outcomes evaluated at once coincide with the outcomes evaluated
+    one by one.
+    '''
+
+    Rv = np.linspace(0.00115, 1.50, 50)
+    Ps, Pn = evaluate_circuit_fast(Rv, z1, z2, np.arange(8), 12)
+    assert Ps.shape == (8, 50) and Pn.shape == (8, 50, 12)
+    for m in range(8):
+        Qs, Qn = evaluate_circuit_fast(Rv, z1, z2, m, 12)
+        assert np.allclose(Ps[m], Qs) and np.allclose(Pn[m], Qn)
+
+def test_circuit_hyp2f1 ():
+    '''
+    The power series of the hypergeometric function, used for the weak
+    squeezing, coincide with the general evaluation.
+    '''
+
+    A = np.arange(1.0, 31.0).reshape(1, 1, -1)
+    C = np.maximum(A - 5.0, 1.0)
+    X = np.linspace(0.0, 0.25, 400)[:, np.newaxis]
+    out = np.empty((1, 400, 30))
+    circuit_hyp2f1(A, C, X, out)
+    assert np.allclose(out, ss.hyp2f1(A, A, C, X), rtol = 1e-13, atol = 0.0)
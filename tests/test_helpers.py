@@ -0,0 +1,240 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import os
+import pickle
+import signal
+import pytest
+import numpy as np
+import zstandard as zstd
+from helpers import zstd_pickle_dump, zstd_pickle_load
+
+@pytest.mark.parametrize('threads', [ 0, -1 ])
+def test_zstd_pickle_roundtrip (tmp_path, threads):
+    '''
+    Out-of-band buffers survive the roundtrip and the loaded arrays are
+    writable views of the decompressed memory.
+    '''
+
+    path = tmp_path / 'what.pickle.zstd'
+    what = {
+        'a' : np.random.default_rng(1).random(size = (51, 51, 6)),
+        'b' : np.arange(100, dtype = np.int32)[::2],
+        'c' : np.empty((0, 6)),
+        'd' : [ 1, 'text' ]
+    }
+
+    zstd_pickle_dump(path, what, level = 1, threads = threads)
+    back = zstd_pickle_load(path)
+
+    assert back['d'] == what['d']
+    for key in 'abc':
+        assert back[key].dtype == what[key].dtype
+        assert np.array_equal(back[key], what[key])
+    assert back['a'].flags.writeable
+
+def test_zstd_pickle_legacy (tmp_path):
+    '''
+    Files holding a single in-band pickle still load.
+    '''
+
+    path = tmp_path / 'what.pickle.zstd'
+    what = np.linspace(0.5, 1.0, 51)
+    with zstd.open(path, 'wb') as file:
+        pickle.dump(what, file)
+
+    assert np.array_equal(zstd_pickle_load(path), what)
+
+def test_profiler_stages ():
+    '''
+    Nested stages are accumulated under their paths and aggregated per
+    target and per worker.
+    '''
+
+    from helpers import TimingReport, profiler, stage
+
+    profiler.collect()
+    for index in range(3):
+        with stage('outer'):
+            with stage('inner'):
+                pass
+    stages = profiler.collect()
+
+    assert set(stages) == { 'outer', 'outer/inner' }
+    assert stages['outer'][1] == 3 and stages['outer/inner'][1] == 3
+    assert stages['outer'][0] >= stages['outer/inner'][0]
+    assert profiler.collect() == {}
+
+    report = TimingReport('target')
+    for worker in [ 'a', 'a', 'b' ]:
+        report.add({ 'worker' : worker, 'time' : 1.0, 'stages' : stages })
+    data = report.as_dict()
+
+    assert data['tasks'] == 3 and data['busy'] == 3.0
+    assert data['stages']['outer']['count'] == 9
+    assert data['workers']['a']['tasks'] == 2
+    assert data['workers']['b']['stages']['outer/inner']['count'] == 3
+
+def test_telemetry_summary ():
+    '''
+    The summary accounts for the idle workers and the stragglers.
+    '''
+
+    from helpers import Telemetry
+
+    telemetry = Telemetry('target')
+    origin = telemetry.origin
+    for index in range(8):
+        worker = 'a' if index % 2 else 'b'
+        compute = 5.0 if index == 7 else 1.0
+        start = origin + index
+        telemetry.add((index, 0), { 'worker' : worker, 'time' : compute,
+            'start' : start, 'end' : start + compute }, start + compute + 0.5)
+    summary = telemetry.summary(count = 1)
+
+    assert summary['cells'] == 8
+    assert summary['span'] == pytest.approx(12.5)
+    assert summary['throughput'] == pytest.approx(8 / 12.5)
+    assert summary['idle'] == pytest.approx(1.0 - 12.0 / 25.0)
+    assert summary['wait_max'] == pytest.approx(0.5)
+    assert summary['stragglers'] == 1
+    assert summary['slowest'] == [ (7, 0, 5.0, 'a') ]
+    assert telemetry.table()['worker'].tolist() == [ 0, 1 ] * 4
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), 
+    reason = 'the peak memory is only reset on Linux')
+def test_taskwrap_peak_memory ():
+    '''
+    The peak memory of each task covers its own allocations only.
+    '''
+
+    from helpers import taskwrap
+
+    def worker (size):
+        return float(np.ones(size).sum())
+
+    large = taskwrap(worker)(((0, ), (2 ** 23, )))[0]['memory']
+    small = taskwrap(worker)(((1, ), (1, )))[0]['memory']
+    assert large - small > 48 * 2 ** 20
+
+def test_execute_tasks_retries ():
+    '''
+    Failed and timed out tasks are retried, tasks failing repeatedly are
+    recorded instead of raising.
+    '''
+
+    import time
+    import concurrent.futures as cf
+    from helpers import execute_tasks, taskwrap
+
+    def worker (x, attempt = 0):
+        if x == 1 and attempt < 2:
+            raise FloatingPointError('overflow')
+        if x == 2:
+            raise MemoryError()
+        if x == 3 and attempt == 0:
+            time.sleep(2.0)
+        return x, attempt
+
+    task_list = [ ((x, ), (x, )) for x in range(4) ]
+    failures = {}
+    with cf.ThreadPoolExecutor(4) as pool:
+        results = { task_spec[0] : task_data 
+            for task_exec, task_spec, task_data in execute_tasks(pool, 
+                taskwrap(worker), task_list, failures, 
+                retries = 2, timeout = 0.5, poll = 0.1) }
+
+    assert results == { (0, ) : (0, 0), (1, ) : (1, 2), (3, ) : (3, 1) }
+    assert list(failures) == [ (2, ) ]
+    assert failures[2, ]['attempts'] == 3
+    assert failures[2, ]['errors'] == [ 'MemoryError: ' ] * 3
+
+def kill_worker (x, attempt = 0):
+    # The pickled workers of the process pools are defined at the top level.
+    if (x == 1 and attempt == 0) or (x == 2):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return x, attempt
+
+def test_execute_tasks_killed_worker ():
+    '''
+    A pool broken by a killed worker is restarted and the killed tasks are 
+    retried, tasks killing their workers repeatedly are recorded.
+    '''
+
+    from helpers import execute_tasks, taskwrap, LocalPool
+
+    task_list = [ ((x, ), (x, )) for x in range(4) ]
+    failures = {}
+    with LocalPool(2) as pool:
+        results = { task_spec[0] : task_data 
+            for task_exec, task_spec, task_data in execute_tasks(pool, 
+                taskwrap(kill_worker), task_list, failures, 
+                retries = 2, poll = 0.1, window = 1) }
+
+    assert results == { (0, ) : (0, 0), (1, ) : (1, 1), (3, ) : (3, 0) }
+    assert list(failures) == [ (2, ) ]
+    assert failures[2, ]['attempts'] == 3
+    assert all(error.startswith('BrokenProcessPool') 
+        for error in failures[2, ]['errors'])
+
+def test_execute_tasks_window ():
+    '''
+    At most window tasks are in flight, the others are submitted as the
+    results arrive.
+    '''
+
+    import concurrent.futures as cf
+    from helpers import execute_tasks, taskwrap
+
+    def worker (x):
+        return x
+
+    class Pool:
+        # Records the largest number of the unfinished submitted tasks.
+        num_workers = 2
+        def __init__ (self, executor):
+            self.executor, self.pending, self.largest = executor, set(), 0
+        def submit (self, fn, * args):
+            future = self.executor.submit(fn, * args)
+            self.pending = { f for f in self.pending if not f.done() } | { future }
+            self.largest = max(self.largest, len(self.pending))
+            return future
+
+    task_list = [ ((x, ), (x, )) for x in range(100) ]
+    with cf.ThreadPoolExecutor(4) as executor:
+        pool = Pool(executor)
+        results = sorted(task_data for _, _, task_data in 
+            execute_tasks(pool, taskwrap(worker), task_list, {}, poll = 0.01))
+
+    assert results == list(range(100))
+    assert pool.largest <= 4
+
+def test_execute_tasks_timed_out_failure ():
+    '''
+    A timed out attempt failing afterwards is not retried again.
+    '''
+
+    import time
+    import threading
+    import concurrent.futures as cf
+    from helpers import execute_tasks, taskwrap
+
+    lock, started = threading.Lock(), []
+    def worker (x, attempt = 0):
+        with lock:
+            started.append(attempt)
+        if attempt == 0:
+            time.sleep(0.6)
+            raise FloatingPointError('overflow')
+        return attempt
+
+    failures = {}
+    with cf.ThreadPoolExecutor(4) as pool:
+        results = [ task_data for _, _, task_data in execute_tasks(pool, 
+            taskwrap(worker), [ ((0, ), (0, )) ], failures, 
+            retries = 3, timeout = 0.25, poll = 0.05) ]
+        time.sleep(0.6)
+
+    assert results == [ 1 ]
+    assert sorted(started) == [ 0, 1 ]
+    assert failures == {}
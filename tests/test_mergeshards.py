@@ -0,0 +1,64 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import pytest
+import numpy as np
+from helpers import shard_cells, zstd_pickle_dump, zstd_pickle_load
+from tilestore import TileStore, open_result
+from mergeshards import shard_path, merge_shards
+
+def write_shards (base, data, count, tile):
+    for index in range(count):
+        path = shard_path(str(base), index, count)
+        cells = shard_cells(data.shape[0], index, count, block = tile)
+        with TileStore.create(f'{path}/target.tiles', data.shape, 
+            tile = (tile, tile)) as store:
+            for i1, i2 in np.ndindex(data.shape[:2]):
+                if cells[i1, i2]:
+                    store.put(i1, i2, data[i1, i2])
+        zstd_pickle_dump(f'{path}/rspace.pickle.zstd', np.arange(3.0))
+        zstd_pickle_dump(f'{path}/zspace.pickle.zstd', np.arange(11.0))
+
+@pytest.mark.parametrize('result_format', [ 'pickle', 'tiles' ])
+def test_merge_shards (tmp_path, result_format):
+    '''
+    The shards cover the grid and merge into the complete target.
+    '''
+
+    data = np.random.default_rng(1).random(size = (11, 11, 6))
+    write_shards(tmp_path, data, count = 3, tile = 2)
+
+    assert merge_shards(str(tmp_path), result_format) == [ 'target' ]
+    merged = open_result(str(tmp_path / 'target'))
+    assert np.array_equal(merged[:, :], data)
+
+def test_merge_shards_missing (tmp_path):
+    '''
+    Incomplete shards are refused.
+    '''
+
+    data = np.zeros((11, 11, 6))
+    write_shards(tmp_path, data, count = 3, tile = 2)
+
+    # The shard lost all its tiles.
+    index_path = tmp_path / 'shard.0001-of-0003' / 'target.tiles' / 'index.npy'
+    np.save(index_path, np.zeros_like(np.load(index_path)))
+
+    with pytest.raises(ValueError, match = 'not covered'):
+        merge_shards(str(tmp_path))
+
+def test_shard_cells ():
+    '''
+    The shards partition the grid into whole blocks, none of them is left
+    idle on the full grid, and more shards than blocks are refused.
+    '''
+
+    masks = [ shard_cells(1001, index, 128, block = 64) for index in range(128) ]
+    assert np.array_equal(np.sum(masks, axis = 0), np.ones((1001, 1001)))
+    assert all(np.any(mask) for mask in masks)
+    for mask in masks[:4]:
+        blocks = mask[::64, ::64]
+        assert np.array_equal(np.repeat(np.repeat(blocks, 64, 0), 64, 1)[:1001, :1001], mask)
+
+    with pytest.raises(ValueError):
+        shard_cells(11, 0, 37, block = 2)
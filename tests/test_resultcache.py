@@ -0,0 +1,35 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import numpy as np
+from resultcache import ResultCache
+
+def test_result_cache (tmp_path):
+    '''
+    Equal parameters share their keys, any changed parameter does not.
+    The cached values persist.
+    '''
+
+    rspace = np.linspace(0.00115, 1.15, 100)
+    zspace = np.linspace(0.5, 1.0, 51)
+    params = { 'rspace' : rspace, 'runs' : 1000, 'tail' : (4, 10) }
+
+    with ResultCache(tmp_path / 'cache.sqlite', code = [ np.linspace ]) as cache:
+        digest = cache.target_digest(** params)
+        assert digest == cache.target_digest(** { ** params, 'tail' : [ 4, 10 ] })
+        assert digest != cache.target_digest(** { ** params, 'runs' : 1001 })
+        assert digest != cache.target_digest(** { ** params, 'rspace' : rspace * 1.5 })
+
+        # Coinciding transmission rates of different grids.
+        finer = np.linspace(0.5, 1.0, 1001)
+        assert cache.cell_key(digest, zspace[7], zspace[9]) \
+            == cache.cell_key(digest, finer[140], finer[180])
+
+        cache.put(cache.cell_key(digest, zspace[7], zspace[9]), (1.0, 0.5))
+
+    with ResultCache(tmp_path / 'cache.sqlite', code = [ np.linspace ]) as cache:
+        key = cache.cell_key(digest, zspace[7], zspace[9])
+        assert cache.get([ key, 'missing' ]) == { key : (1.0, 0.5) }
+
+    with ResultCache(tmp_path / 'cache.sqlite', code = [ np.logspace ]) as cache:
+        assert cache.target_digest(** params) != digest
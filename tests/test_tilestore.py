@@ -0,0 +1,53 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import pytest
+import numpy as np
+from tilestore import TileStore, tilestore_from_array
+
+@pytest.fixture
+def array ():
+    array = np.random.default_rng(1).random(size = (23, 23, 6))
+    array[3:7, 11] = np.nan
+    return array
+
+@pytest.mark.parametrize('level', [ None, 3 ])
+@pytest.mark.parametrize('key', [
+    (slice(None), ),
+    (5, ),
+    (5, 17),
+    (slice(2, 20, 3), 7, 0),
+    (slice(None), slice(None), [ 0, 2 ]),
+    (-1, slice(None, None, -1), 1)
+])
+def test_tilestore_read (tmp_path, array, level, key):
+    '''
+    Partial reads match the numpy indexing of the stored array.
+    '''
+
+    tilestore_from_array(tmp_path / 'array.tiles', array,
+        tile = (5, 8), level = level)
+    store = TileStore.open(tmp_path / 'array.tiles')
+
+    assert np.array_equal(store[key], array[key], equal_nan = True)
+
+def test_tilestore_put (tmp_path, array):
+    '''
+    Cells written one by one, in any order, are assembled into tiles.
+    '''
+
+    order = np.random.default_rng(2).permutation(23 * 23)
+    with TileStore.create(tmp_path / 'array.tiles', array.shape, (5, 8)) as store:
+        for i1, i2 in zip(* np.unravel_index(order[:-1], (23, 23))):
+            store.put(i1, i2, array[i1, i2])
+        assert store.coverage().sum() == 23 * 23 - 1
+
+    store = TileStore.open(tmp_path / 'array.tiles')
+    i1, i2 = np.unravel_index(order[-1], (23, 23))
+
+    assert np.all(np.isnan(store[i1, i2]))
+    assert store.coverage().all()
+
+    expect = array.copy()
+    expect[i1, i2] = np.nan
+    assert np.array_equal(store.read(), expect, equal_nan = True)
@@ -0,0 +1,204 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+
+import os
+import sys
+import pytest
+import numpy as np
+
+# The sweeps are run from within the unified directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'unified'))
+
+import unified
+from circuit import evaluate_circuit_pnrd_pnrd
+
+def make_cell (size = 100, m = 3, d = 20):
+    Rv = np.linspace(0.1, 1.0, size)
+    Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, 0.9, 0.9, m, d)
+    return Rv, Ps, Pn
+
+def make_rng (file_name = 'pnrd_pnrd_03', z1 = 0.9, z2 = 0.9, seed = 2025):
+    return unified.cell_generator(seed, 'PCG64', file_name, z1, z2)
+
+def test_cell_sampler_precision ():
+    '''
+    The single precision draws the same events, its frequencies and counts
+    are of the narrower types and the statistics agree with the double
+    precision ones.
+    '''
+
+    Rv, Ps, Pn = make_cell()
+    S = {}
+    for precision in [ 'single', 'double' ]:
+        Cs, Fn = unified.cell_sampler(Ps, Pn, rate = 1e6, runs = 200,
+            precision = precision, rng = make_rng())
+        S[precision] = unified.cell_statistics(Ps, Cs, Fn, 3)
+        if precision == 'single':
+            assert Fn.dtype == np.float32
+            assert Cs.dtype == np.int32
+
+    assert S['single'].dtype == np.float64
+    assert np.any(S['double'][:, 1] > 0)
+    assert np.allclose(S['single'], S['double'], rtol = 1e-5, atol = 0)
+
+def test_cell_generator_reproducible ():
+    '''
+    The stream of a cell only depends on the seed, the target and the
+    transmission rates of the cell.
+    '''
+
+    draws = lambda * args, ** kwargs: make_rng(* args, ** kwargs).random(16)
+
+    assert np.array_equal(draws(), draws())
+    assert np.array_equal(draws(), unified.task_generator(
+        unified.Sweep(sample_seed = 2025), 3, None, 0.9, 0.9).random(16))
+    for other in [ dict(file_name = 'pnrd_pnrd_04'), 
+        dict(file_name = 'capd_pnrd_03_10'), 
+        dict(z1 = 0.8), dict(z2 = 0.8), dict(seed = 2026) ]:
+        assert not np.array_equal(draws(), draws(** other))
+
+@pytest.mark.parametrize('circuit_mode', [ 'full', 'tail' ])
+def test_task_worker_cell_plans (circuit_mode):
+    '''
+    The targets of a cell sampled at once (the shared plan) match the targets 
+    sampled by their separate workers.
+    '''
+
+    sweep = unified.Sweep('test', 
+        sample_r_num = 100,
+        experiment_runs = 100,
+        detector_pnrd = [ 3, 4 ],
+        detector_capd_click = [ 3 ],
+        detector_capd_width = [ 10 ],
+        herald_capd_span = 20,
+        circuit_mode = circuit_mode,
+        result_stats = True)
+    Rv, z1, z2 = sweep.rspace, 0.9, 0.8
+
+    shared = unified.task_worker_cell(sweep, Rv, z1, z2)
+    for file_name, m, M in unified.cell_targets(sweep):
+        separate = unified.task_worker_target_pnrd_pnrd(sweep, Rv, z1, z2, m) \
+            if M is None else \
+            unified.task_worker_target_capd_pnrd(sweep, Rv, z1, z2, m, M)
+        for output_name, output in separate.items():
+            assert np.array_equal(shared[file_name, output_name], output, 
+                equal_nan = True)
+
+@pytest.mark.parametrize('threads, blocks', [ (3, 1), (1, 4), (3, 4) ])
+def test_cell_sampler_threads_blocks (threads, blocks):
+    '''
+    Neither the threads nor the blocks of the runs change the samples.
+    '''
+
+    # (@) Several blocks of the rates, the last one partial.
+    Rv, Ps, Pn = make_cell(size = 3 * unified.SAMPLE_RATE_BLOCK + 10)
+    Cs, Fn = unified.cell_sampler(Ps, Pn, rate = 1e6, runs = 100, 
+        rng = make_rng())
+    Ct, Ft = unified.cell_sampler(Ps, Pn, rate = 1e6, runs = 100, 
+        blocks = blocks, threads = threads, rng = make_rng())
+
+    assert np.any(Fn > 0)
+    assert np.array_equal(Cs, Ct)
+    assert np.array_equal(Fn, Ft)
+
+@pytest.mark.parametrize('size', [ 10, 200, 1000 ])
+@pytest.mark.parametrize('task_memory', [ None, 2 ** 20, 2 ** 23, 2 ** 24, 2 ** 30 ])
+def test_sample_plan_chunks (size, task_memory):
+    '''
+    The rates are sampled in whole blocks, no more of them than there are.
+    '''
+
+    sweep = unified.Sweep('test', experiment_runs = 1000, 
+        task_memory = task_memory)
+    chunk, blocks = unified.sample_plan(sweep, size, 20)
+
+    assert 0 < chunk <= size
+    assert chunk == size or chunk % unified.SAMPLE_RATE_BLOCK == 0
+    assert 1 <= blocks <= sweep.experiment_runs
+
+def test_sample_plan_blocks ():
+    '''
+    The runs are split into more blocks only while a block of the rates fits
+    the budget, retried cells split them further.
+    '''
+
+    plan = lambda task_memory, attempt = 0: unified.sample_plan(
+        unified.Sweep('test', experiment_runs = 1000, task_memory = task_memory),
+        1000, 20, attempt)
+
+    # (@) A block of the rates takes about 11.8 MB, the events of all the 
+    #     runs of the block about 10.2 MB.
+    assert plan(None) == (1000, 1)
+    assert plan(2 ** 20) == (unified.SAMPLE_RATE_BLOCK, 1)
+    assert plan(2 ** 30) == (1000, 1)
+    chunk, blocks = plan(16 * 2 ** 20)
+    assert chunk == unified.SAMPLE_RATE_BLOCK and blocks > 1
+    assert plan(16 * 2 ** 20, attempt = 1)[1] >= max(4, blocks)
+    assert plan(None, attempt = 2) == (1000, 16)
+
+def test_task_sample_memory ():
+    '''
+    The statistics do not depend on the chunks and blocks of the budget.
+    '''
+
+    sweep = unified.Sweep('test', sample_r_num = 200, experiment_runs = 200,
+        experiment_rate = 1_000_000,
+        certify_criteria = [ (None, 3, 3), (4, 3, 3) ])
+    Rv, Ps, Pn = make_cell(size = sweep.sample_r_num)
+
+    S = unified.task_sample(sweep, Ps, Pn, 3, make_rng())
+    sweep.task_memory = 3 * 2 ** 20
+    assert unified.sample_plan(sweep, Ps.size, Pn.shape[-1]) \
+        == (unified.SAMPLE_RATE_BLOCK, 4)
+    T = unified.task_sample(sweep, Ps, Pn, 3, make_rng())
+
+    assert S.keys() == T.keys() == { None, 4 }
+    for level in S:
+        assert np.any(S[level][:, 1] > 0)
+        assert np.array_equal(S[level], T[level])
+
+def test_sweep_stats_tiles ():
+    '''
+    The statistics are only stored within tile stores.
+    '''
+
+    assert unified.Sweep(result_format = 'pickle').result_format == 'pickle'
+    assert unified.Sweep(result_format = 'pickle', 
+        result_stats = True).result_format == 'tiles'
+
+def test_cache_params_streams (monkeypatch):
+    '''
+    The cache keys change with the blocks of the streams and the code 
+    deriving the streams of the cells.
+    '''
+
+    from resultcache import ResultCache
+
+    sweep = unified.Sweep()
+    digest = lambda: ResultCache(':memory:', code = unified.CACHE_CODE).target_digest(
+        ** unified.make_cache_params(sweep))
+    before = digest()
+    monkeypatch.setattr(unified, 'SAMPLE_RATE_BLOCK', 32)
+    assert digest() != before
+
+    for function in [ unified.cell_generator, unified.task_generator, 
+        unified.target_file_name ]:
+        assert function in unified.CACHE_CODE
+
+def test_sample_pool_threads ():
+    '''
+    The pool of the sampling threads is kept for the same number of threads,
+    the pool of another number is shut down.
+    '''
+
+    Rv, Ps, Pn = make_cell(size = 2 * unified.SAMPLE_RATE_BLOCK)
+    unified.cell_sampler(Ps, Pn, runs = 10, threads = 2)
+    pool = unified.sample_pool(2)
+    assert unified.sample_pool(2) is pool
+
+    unified.cell_sampler(Ps, Pn, runs = 10, threads = 3)
+    assert unified.sample_pool(3) is not pool
+    with pytest.raises(RuntimeError):
+        pool.submit(int)
+    assert not any(thread.is_alive() for thread in pool._threads)
@@ -0,0 +1,398 @@
+# 2025 Jan Provaznik (provaznik@optics.upol.cz)
+#
+# This module implements a chunked on-disk store for the simulation results.
+# Please refer to the documentation strings of the classes and functions for
+# details.
+#
+# The results are arrays indexed by the (zeta1, zeta2) grid, their trailing
+# dimensions describe the individual cells. The grid is split into tiles that
+# are stored (and compressed) independently. Reading a single row or column
+# only inflates the tiles it intersects.
+#
+# The store is a directory with three files,
+#
+#   meta.json   ... shape, dtype, tile shape, compression and attributes,
+#   index.npy   ... (offset, size, codec) of each tile within the data file,
+#   tiles.bin   ... the tiles themselves, appended one after another.
+#
+# Uncompressed tiles are accessed through memory mapping.
+
+import os
+import json
+import glob
+import time
+import argparse
+
+import numpy as np
+import zstandard as zstd
+
+TILE_MISSING = 0
+TILE_RAW = 1
+TILE_ZSTD = 2
+
+TILESTORE_SUFFIX = '.tiles'
+TILESTORE_VERSION = 1
+
+class TileStore:
+    '''
+    Chunked, random-access store of an array whose first two dimensions span
+    the (zeta1, zeta2) grid.
+
+    Use TileStore.create to make a new store and TileStore.open to access an
+    existing one. The store supports numpy-like partial reads,
+
+        store[i1, :, 0]         ... a single row of the success rates
+        store[:, i2]            ... a single column of all the planes
+
+    writing whole tiles (write_tile) and incremental writing of individual
+    cells (put) as they arrive from the dispatcher.
+    '''
+
+    def __init__ (self, path, meta, index, mode):
+        self._path = path
+        self._meta = meta
+        self._index = index
+        self._mode = mode
+        self._pending = {}
+        self._saved = time.monotonic()
+
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.tile = tuple(meta['tile'])
+        self.level = meta['level']
+        self.attrs = meta['attrs']
+
+        self._data = open(self._data_path, 'r+b' if mode == 'w' else 'rb')
+
+    @classmethod
+    def create (cls, path, shape, tile = (64, 64),
+        dtype = np.float64, level = 3, attrs = None):
+        '''
+        Creates an empty store, all the cells read as NaN until written.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store, created if necessary.
+        shape : tuple
+            Shape of the stored array. The first two dimensions are tiled.
+        tile : tuple
+            Shape of a tile along the first two dimensions.
+        dtype : np.dtype
+            Type of the stored array.
+        level : int | None
+            Compression level of the zstandard algorithm.
+            The tiles are stored uncompressed (and memory mapped) if None.
+        attrs : dict
+            Additional attributes (json serializable) stored in metadata.
+
+        Returns
+        -------
+        TileStore
+            The store opened for writing.
+        '''
+
+        os.makedirs(path, exist_ok = True)
+
+        meta = {
+            'format' : 'tilestore',
+            'version' : TILESTORE_VERSION,
+            'shape' : [ int(v) for v in shape ],
+            'dtype' : np.dtype(dtype).str,
+            'tile' : [ int(v) for v in tile ],
+            'level' : level,
+            'attrs' : attrs or {}
+        }
+
+        count = _tile_count(meta['shape'], meta['tile'])
+        index = np.zeros(shape = (* count, 3), dtype = np.int64)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent = 2)
+        with open(os.path.join(path, 'tiles.bin'), 'wb'):
+            pass
+
+        store = cls(path, meta, index, 'w')
+        store._save_index()
+        return store
+
+    @classmethod
+    def open (cls, path, mode = 'r'):
+        '''
+        Opens an existing store, either for reading (r) or writing (w).
+        '''
+
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        if meta.get('format') != 'tilestore':
+            raise ValueError(f'Not a tile store: {path}')
+        index = np.load(os.path.join(path, 'index.npy'))
+        return cls(path, meta, index, mode)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, * args):
+        self.close()
+
+    def close (self):
+        if self._data.closed:
+            return
+        if self._mode == 'w':
+            self.flush()
+            self._save_index()
+        self._data.close()
+
+    @property
+    def _data_path (self):
+        return os.path.join(self._path, 'tiles.bin')
+
+    @property
+    def ndim (self):
+        return len(self.shape)
+
+    @property
+    def tile_count (self):
+        return self._index.shape[:2]
+
+    def tile_bounds (self, t1, t2):
+        '''
+        Returns the (begin, end) grid index pairs covered by a tile.
+        '''
+
+        T1, T2 = self.tile
+        N1, N2 = self.shape[:2]
+        return (
+            (t1 * T1, min(N1, (t1 + 1) * T1)),
+            (t2 * T2, min(N2, (t2 + 1) * T2)))
+
+    def tile_shape (self, t1, t2):
+        (a1, b1), (a2, b2) = self.tile_bounds(t1, t2)
+        return (b1 - a1, b2 - a2, * self.shape[2:])
+
+    def has_tile (self, t1, t2):
+        return bool(self._index[t1, t2, 2] != TILE_MISSING)
+
+    def coverage (self):
+        '''
+        Returns a boolean mask over the grid indicating the written cells.
+        '''
+
+        mask = np.zeros(self.shape[:2], dtype = bool)
+        for t1, t2 in np.ndindex(self.tile_count):
+            if self.has_tile(t1, t2):
+                (a1, b1), (a2, b2) = self.tile_bounds(t1, t2)
+                mask[a1:b1, a2:b2] = True
+        for (t1, t2), (data, seen) in self._pending.items():
+            (a1, b1), (a2, b2) = self.tile_bounds(t1, t2)
+            mask[a1:b1, a2:b2] |= seen
+        return mask
+
+    # Reading
+    #
+
+    def read_tile (self, t1, t2):
+        '''
+        Reads a single tile. Uncompressed tiles are returned as read-only
+        memory maps, missing tiles are filled with NaN.
+        '''
+
+        if (t1, t2) in self._pending:
+            return self._pending[t1, t2][0]
+
+        shape = self.tile_shape(t1, t2)
+        offset, size, codec = self._index[t1, t2]
+
+        if codec == TILE_MISSING:
+            return np.full(shape, np.nan, dtype = self.dtype)
+        if codec == TILE_RAW:
+            if size == 0:
+                return np.empty(shape, dtype = self.dtype)
+            return np.memmap(self._data_path,
+                dtype = self.dtype, mode = 'r',
+                offset = int(offset), shape = shape)
+        if codec == TILE_ZSTD:
+            self._data.seek(offset)
+            data = zstd.ZstdDecompressor().decompress(self._data.read(size),
+                max_output_size = int(np.prod(shape)) * self.dtype.itemsize)
+            return np.frombuffer(data, dtype = self.dtype).reshape(shape)
+
+        raise ValueError(f'Unknown tile codec {codec} in {self._path}')
+
+    def __getitem__ (self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        key = key + (slice(None), ) * max(0, 2 - len(key))
+        k1, k2, tail = key[0], key[1], key[2:]
+
+        I1 = np.arange(self.shape[0])[k1]
+        I2 = np.arange(self.shape[1])[k2]
+        V1 = np.atleast_1d(I1)
+        V2 = np.atleast_1d(I2)
+
+        # Select the trailing dimensions on the tiles, before assembling them,
+        # only the requested planes are ever copied.
+        tail = (slice(None), slice(None), * tail)
+        tail_shape = np.empty((1, 1, * self.shape[2:]))[tail].shape[2:]
+        result = np.empty((V1.size, V2.size, * tail_shape), dtype = self.dtype)
+
+        T1, T2 = self.tile
+        for t1 in np.unique(V1 // T1):
+            M1 = (V1 // T1) == t1
+            for t2 in np.unique(V2 // T2):
+                M2 = (V2 // T2) == t2
+                data = self.read_tile(t1, t2)[tail]
+                result[np.ix_(M1, M2)] = \
+                    data[np.ix_(V1[M1] - t1 * T1, V2[M2] - t2 * T2)]
+
+        return result[(
+            0 if np.ndim(I1) == 0 else slice(None),
+            0 if np.ndim(I2) == 0 else slice(None))]
+
+    def read (self):
+        '''
+        Reads the whole array.
+        '''
+
+        return self[:, :]
+
+    # Writing
+    #
+
+    def write_tile (self, t1, t2, data):
+        '''
+        Writes (or overwrites) a single tile. Overwritten tiles leave their
+        previous contents within the data file.
+        '''
+
+        if self._mode != 'w':
+            raise ValueError(f'Store {self._path} is read-only')
+
+        data = np.ascontiguousarray(data, dtype = self.dtype)
+        if data.shape != self.tile_shape(t1, t2):
+            raise ValueError(f'Invalid tile shape {data.shape}')
+
+        if self.level is None:
+            blob, codec = memoryview(data).cast('B'), TILE_RAW
+        else:
+            blob = zstd.ZstdCompressor(level = self.level).compress(data)
+            codec = TILE_ZSTD
+
+        # The raw tiles are aligned for the memory mapping.
+        offset = self._data.seek(0, os.SEEK_END)
+        offset += (- offset) % self.dtype.itemsize
+        self._data.seek(offset)
+        self._data.write(blob)
+        self._data.flush()
+
+        # The index is saved periodically (and on close), a store left
+        # unclosed misses at most the last second of writes.
+        self._index[t1, t2] = offset, len(blob), codec
+        if time.monotonic() - self._saved > 1.0:
+            self._save_index()
+        self._pending.pop((t1, t2), None)
+
+    def put (self, i1, i2, value):
+        '''
+        Writes a single cell. The cells are gathered into their tiles, a tile
+        is written as soon as all its cells arrive.
+        '''
+
+        T1, T2 = self.tile
+        t1, t2 = i1 // T1, i2 // T2
+
+        if (t1, t2) not in self._pending:
+            data = np.array(self.read_tile(t1, t2))
+            seen = np.zeros(data.shape[:2], dtype = bool)
+            self._pending[t1, t2] = data, seen
+
+        data, seen = self._pending[t1, t2]
+        data[i1 - t1 * T1, i2 - t2 * T2] = value
+        seen[i1 - t1 * T1, i2 - t2 * T2] = True
+
+        if seen.all():
+            self.write_tile(t1, t2, data)
+
+    def flush (self):
+        '''
+        Writes the partially filled tiles.
+        '''
+
+        for (t1, t2), (data, seen) in list(self._pending.items()):
+            self.write_tile(t1, t2, data)
+
+    def _save_index (self):
+        path = os.path.join(self._path, 'index.npy')
+        temp = path + '.temp'
+        with open(temp, 'wb') as file:
+            np.save(file, self._index)
+        os.replace(temp, path)
+        self._saved = time.monotonic()
+
+def _tile_count (shape, tile):
+    return tuple(- (- n // t) for n, t in zip(shape[:2], tile))
+
+def open_result (path):
+    '''
+    Opens a result stored either as a tile store (path.tiles) or as a single
+    compressed pickle (path.pickle.zstd). Both support numpy indexing.
+    '''
+
+    if os.path.isdir(path + TILESTORE_SUFFIX):
+        return TileStore.open(path + TILESTORE_SUFFIX)
+
+    # The helpers module depends on this one, import lazily.
+    from helpers import zstd_pickle_load
+    return zstd_pickle_load(path + '.pickle.zstd')
+
+# Conversion of the existing datasets.
+#
+
+def tilestore_from_array (path, array, tile = (64, 64), level = 3, attrs = None):
+    '''
+    Stores an array into a new tile store.
+    '''
+
+    with TileStore.create(path, array.shape, tile,
+        dtype = array.dtype, level = level, attrs = attrs) as store:
+        for t1, t2 in np.ndindex(store.tile_count):
+            (a1, b1), (a2, b2) = store.tile_bounds(t1, t2)
+            store.write_tile(t1, t2, array[a1:b1, a2:b2])
+
+def convert_dataset (source, target, tile = (64, 64), level = 3):
+    '''
+    Converts a dataset directory (see results/README) into tile stores.
+    The result arrays are converted, the parameter files are copied.
+    '''
+
+    # The helpers module depends on this one, import lazily.
+    from helpers import zstd_pickle_load, zstd_pickle_dump
+
+    os.makedirs(target, exist_ok = True)
+    for path in sorted(glob.glob(os.path.join(source, '*.pickle.zstd'))):
+        name = os.path.basename(path).removesuffix('.pickle.zstd')
+        data = zstd_pickle_load(path)
+
+        if np.ndim(data) < 3:
+            zstd_pickle_dump(os.path.join(target, f'{name}.pickle.zstd'), data)
+            continue
+
+        print(f'Converting {name}')
+        tilestore_from_array(
+            os.path.join(target, name + TILESTORE_SUFFIX), data,
+            tile = tile, level = level, attrs = { 'source' : path })
+
+if (__name__ == '__main__'):
+    parser = argparse.ArgumentParser(
+        description = 'Converts result datasets into tile stores.')
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--tile', type = int, default = 64)
+    parser.add_argument('--level', type = int, default = 3)
+    parser.add_argument('--raw', action = 'store_true',
+        help = 'store the tiles uncompressed (memory mapped access)')
+    args = parser.parse_args()
+
+    convert_dataset(args.source, args.target,
+        tile = (args.tile, args.tile),
+        level = None if args.raw else args.level)
@@ -0,0 +1 @@
+../mergeshards.py
\ No newline at end of file
@@ -0,0 +1 @@
+../resultcache.py
\ No newline at end of file
@@ -10,151 +10,793 @@ DEF_SAMPLE_R_NUM = 1000
 DEF_SAMPLE_R_BEG = 0.00115
 DEF_SAMPLE_R_END = 1.15
 
-# Alternatively, for approximately 15dB squeezing.
-# DEF_SAMPLE_R_BEG = 0.0015
-# DEF_SAMPLE_R_END = 1.50
+# Alternatively, for approximately 15dB squeezing, see the 15dB sweep
+# in sweeps.toml (and Sweeps below).
 
 DEF_SAMPLE_Z_NUM = 51
-# DEF_SAMPLE_Z_NUM = 1001
 DEF_SAMPLE_Z_BEG = 0.5
 DEF_SAMPLE_Z_END = 1.0
 
+# Either 'double', keeping the frequencies in float64 (the heralding counts in
+# int64), or 'single', keeping them in float32 (the counts in int32). Only the
+# frequencies, the arrays kept for the whole chunk of rates, take half the
+# memory; the events are drawn as int64 either way (numpy multinomial), per 
+# block of the runs (see sample_plan). The moments are accumulated in float64
+# either way.
+# The certification compares the moments at the resolution of their standard
+# deviations, far above the rounding of the frequencies.
+DEF_SAMPLE_PRECISION = 'double'
+
+# The sampling of every cell draws from its own stream, derived from the seed
+# of the run, the target and the transmission rates of the cell (see 
+# cell_generator), the results do not depend on the worker computing the cell
+# nor on the order of the cells. None seeds the streams from fresh entropy.
+# The streams are generated by the given bit generator of numpy.random, e.g. 
+# 'PCG64', 'PCG64DXSM', 'Philox' or 'SFC64' (usually the fastest).
+DEF_SAMPLE_SEED = 2025
+DEF_SAMPLE_GENERATOR = 'PCG64'
+
+# Each worker samples its cells using this many threads (see cell_sampler),
+# e.g. when running fewer workers than cores to save memory. The results do 
+# not depend on the number of threads.
+DEF_SAMPLE_THREADS = 1
+
+# Memory budget of the sampling within each worker, in bytes, None for no
+# budget. The squeezing rates of a cell are then sampled and reduced in 
+# chunks, and the runs in blocks, sized to fit the budget (see sample_plan).
+# The results do not depend on the budget. The peak memory of the tasks is 
+# reported along with their timing and telemetry.
+DEF_TASK_MEMORY = None
+
 DEF_HERALD_CAPD_SPAN = 100
 DEF_RESULT_DIMENSION = 20
 
+# Either 'tail', computing only the coefficients up to the highest level
+# certified and the remaining probability (see circuit.append_tail), 'full',
+# computing DEF_RESULT_DIMENSION coefficients, or 'adaptive', computing the
+# least number of coefficients (beyond the highest level certified) needed 
+# for the truncation error not to exceed DEF_CIRCUIT_TOLERANCE. In the full
+# mode, the probability beyond the computed coefficients is not lost, the
+# sampling (numpy multinomial) folds it into the last coefficient. The tail
+# mode samples it as a category of its own instead, beyond the certified 
+# level, and computes fewer coefficients, which makes it faster. The events 
+# beyond the certified level are summed by the certification either way, 
+# the results of the tail mode differ from those of the full mode, such as
+# the published datasets (see results/README), by the random draws only (of
+# fewer categories). Sweeps opt into it, see the tail sweeps in sweeps.toml.
+# The adaptive mode stores the dimension and the
+# truncation error of every cell as a separate output, <target>.truncation.
+DEF_CIRCUIT_MODE = 'full'
+DEF_CIRCUIT_TOLERANCE = 1e-10
+
+# Either 'shared', computing all the targets of a cell in a single task from 
+# the shared terms of the circuits (the CAPD circuits are mixtures of the PNRD
+# ones, see circuit.evaluate_circuit_shared), or 'separate', computing each 
+# target on its own. The adaptive circuit mode always uses the latter.
+DEF_CIRCUIT_PLAN = 'shared'
+
 DEF_DETECTOR_PNRD = [ 3, 4, 5 ]
 DEF_DETECTOR_CAPD_CLICK = [ 3, 4, 5 ]
 DEF_DETECTOR_CAPD_WIDTH = [ 10, 15, 20 ]
 
+# Certification criteria (level, x_mul, y_mul) evaluated on the same sampled
+# statistics; level None stands for the level of the target (its outcome m).
+# The first criterion gives the result of the target, each of the others is
+# stored as a separate output named after it (see criterion_name), such as
+# pnrd_pnrd_04.X5_Y5 or pnrd_pnrd_04.L3_X3_Y3.
+DEF_CERTIFY_CRITERIA = [ (None, 3, 3) ]
+DEF_CERTIFY_COUNT = 1000
+
+# Either 'pickle' (a single compressed array per target) or 'tiles' (chunked
+# store written incrementally, see tilestore module).
+DEF_RESULT_FORMAT = 'pickle'
+DEF_RESULT_TILE = 64
+
+# Store the per-rate sufficient statistics (Ps, Cs, aX, sX, aY, sY) of every
+# cell alongside the results, allowing re-certification under different
+# criteria without resimulation (see recertify module). These are large,
+# (N, N, DEF_SAMPLE_R_NUM, 6), and use smaller tiles. The statistics are
+# stored for each level of the certification criteria. The sweeps storing
+# them always use the tile stores (DEF_RESULT_FORMAT is then ignored).
+DEF_RESULT_STATS = False
+DEF_RESULT_STATS_TILE = 8
+
+# Cells are cached under a hash of their parameters and the code version,
+# only the cells with changed inputs are recomputed. None disables the cache.
+# Each shard keeps its own cache, e.g. 'cache.shard.0007-of-0128.sqlite'.
+DEF_RESULT_CACHE = 'cache.sqlite'
+
+# The results are stored within this directory.
+DEF_RESULT_PATH = 'result'
+
+# Either 'mpi' (mpi4py.futures, see below), 'local' (a pool of processes on
+# this machine, DEF_EXECUTOR_WORKERS of them, all cores if None) or 'serial'
+# (within the master process).
+DEF_EXECUTOR = 'mpi'
+DEF_EXECUTOR_WORKERS = None
+
+# Failed cells are retried (with the sampling split into more blocks, see
+# cell_sampler), cells running longer than the timeout (in seconds, None
+# disables it) are resubmitted. Cells failing repeatedly are recorded in
+# <target>.failed.json and left undetermined. The hung cells are not killed,
+# they keep their workers and the sweep still waits for them at the end.
+DEF_TASK_RETRIES = 3
+DEF_TASK_TIMEOUT = None
+
+# Measured per-cell costs of the targets (see helpers.CostModel), stored
+# within DEF_RESULT_PATH, shared by the sweep and its estimate (--estimate).
+DEF_COST_MODEL = 'costs.json'
+
 # Off we go.
 #
 
+import os
+import hashlib
+import argparse
+import tomllib
 import numpy as np
 import itertools as it
 import functools as ft
-import mpi4py.futures
+import concurrent.futures as cf
+
+import circuit
+import certify
+import stellar
 
 from circuit import evaluate_circuit_pnrd_pnrd
 from circuit import evaluate_circuit_capd_pnrd
+from circuit import detector_capd_weights
+from circuit import CircuitWorkspace
+from circuit import evaluate_circuit_shared, append_tail
 from stellar import threshold_curve
-from certify import threshold_curve_certify
-from helpers import zstd_pickle_dump, zstd_pickle_load
-from helpers import Stopwatch, taskwrap, master_target_dispatcher
+from certify import certified_optimum
+from helpers import zstd_pickle_dump, zstd_pickle_load, array_split_blocks
+from helpers import Stopwatch, stage, taskwrap, master_target_dispatcher
+from helpers import SerialPool, LocalPool, make_file_name
+from helpers import CostModel, master_target_estimator
+from resultcache import ResultCache
+from mergeshards import shard_path, parse_shard, SHARD_PATTERN
 
-def cell_sampler (Ps, Pn):
-    rng = np.random.default_rng()
+# The squeezing rates are sampled in blocks of this size, each block drawing
+# from its own stream (see cell_sampler).
+SAMPLE_RATE_BLOCK = 64
+
+def cell_sampler (Ps, Pn, rate = None, runs = None, blocks = 1, 
+    precision = None, rng = None, threads = None):
+    rng = np.random.default_rng() if rng is None else rng
+    rate = DEF_EXPERIMENT_RATE if rate is None else rate
+    runs = DEF_EXPERIMENT_RUNS if runs is None else runs
+    threads = DEF_SAMPLE_THREADS if threads is None else threads
+    count_type, frequency_type = sample_types(
+        DEF_SAMPLE_PRECISION if precision is None else precision)
 
     # (@) Sanitize Pn values.
     Pn = np.clip(Pn, 0.0, 1.0)
 
     # Cs ... count of successful heralding events within a single run
-    Cs = np.int64(DEF_EXPERIMENT_RATE * Ps)
-    # Cn ... simulated characterization events
-    Cn = rng.multinomial(Cs, Pn, 
-        size = (DEF_EXPERIMENT_RUNS, DEF_SAMPLE_R_NUM))
-    Cn = np.swapaxes(Cn, 0, 1)
-
-    # Fn ... simulated characterization frequencies
-    Fn = np.divide(Cn, Cn.sum(axis = -1)[..., np.newaxis], 
-        where = (Cs > 0)[..., np.newaxis, np.newaxis])
+    Cs = (rate * Ps).astype(count_type)
+
+    Fn = np.zeros((Ps.size, runs, Pn.shape[-1]), dtype = frequency_type)
+
+    # (@) The squeezing rates are sampled in blocks of a fixed size, each 
+    #     drawing from its own stream spawned from rng. The blocks are dealt 
+    #     to the threads, the results do not depend on their number.
+    def sample (stream, Cr, Pr, Fr):
+        # (@) The runs are sampled in blocks, bounding the memory taken by 
+        #     the (integer) events on top of the frequencies.
+        for Fb in array_split_blocks(Fr, - (- runs // blocks), axis = 1):
+            # Cn ... simulated characterization events
+            Cn = stream.multinomial(Cr, Pr, 
+                size = (Fb.shape[1], Cr.size))
+            Cn = np.swapaxes(Cn, 0, 1)
+
+            # Fn ... simulated characterization frequencies
+            # (@) The events of each run sum up to Cs.
+            np.divide(Cn, Cr[:, np.newaxis, np.newaxis], 
+                out = Fb,
+                dtype = frequency_type,
+                where = (Cr > 0)[..., np.newaxis, np.newaxis])
+
+    rate_blocks = list(zip(
+        array_split_blocks(Cs, SAMPLE_RATE_BLOCK), 
+        array_split_blocks(Pn, SAMPLE_RATE_BLOCK), 
+        array_split_blocks(Fn, SAMPLE_RATE_BLOCK)))
+    streams = rng.spawn(len(rate_blocks))
+    if threads > 1:
+        # (@) The generators release the GIL while sampling.
+        list(sample_pool(threads).map(sample, streams, * zip(* rate_blocks)))
+    else:
+        for stream, rate_block in zip(streams, rate_blocks):
+            sample(stream, * rate_block)
     return Cs, Fn
 
-def cell_process (Rv, Ps, Cs, Fn, level):
+_sample_pool = None
+
+def sample_pool (threads):
+    # Created within the worker processes, on their first use. The pool of 
+    # another number of threads is shut down, its threads would be left.
+    global _sample_pool
+    if (_sample_pool is None) or (_sample_pool[0] != threads):
+        if _sample_pool is not None:
+            _sample_pool[1].shutdown()
+        _sample_pool = (threads, cf.ThreadPoolExecutor(threads))
+    return _sample_pool[1]
+
+def sample_types (precision):
+    # The types of the counts and the frequencies of the sampling.
+    if precision == 'double':
+        return np.int64, np.float64
+    if precision == 'single':
+        return np.int32, np.float32
+    raise ValueError(f'Unknown sample precision {precision}')
+
+def cell_statistics (Ps, Cs, Fn, level):
     '''
-    Rv ... a list of squeezing rates
     Ps ... theoretical probability of successful heralding event
            computed for each squeezing rate
     Cs ... counts of successful heralding events
            computed for each squeezing rate
-    Fn ... theoretical P(n) of the prepared state
-           computed for each squeezing rate
+    Fn ... simulated characterization frequencies
+           computed for each squeezing rate and run
+
+    Returns the per-rate sufficient statistics of the certification, 
+    an array of shape (R, 6) with columns (Ps, Cs, aX, sX, aY, sY).
     '''
 
     # Xn, Yn ... certification (threshold curve) points
     Xn = Fn[..., level + 1:].sum(axis = -1)
     Yn = Fn[..., level]
     # a?, s? ... certification (threshold curve) points (statistics)
-    aX, sX = Xn.mean(axis = 1), Xn.std(axis = 1)
-    aY, sY = Yn.mean(axis = 1), Yn.std(axis = 1)
+    # (@) Accumulated in float64, whatever the precision of the frequencies.
+    aX, sX = Xn.mean(axis = 1, dtype = np.float64), Xn.std(axis = 1, dtype = np.float64)
+    aY, sY = Yn.mean(axis = 1, dtype = np.float64), Yn.std(axis = 1, dtype = np.float64)
 
-    # Ml ... certification (threshold curve, 3 sigma) based on (Lachman, 2019)
-    Ml = threshold_curve_certify(threshold_curve(level), aX, sX, 3, aY, sY, 3)
-    # Mc ... consider only those where Ps[res] > threshold
-    Mc = Cs > 1000
-    # Mx ... by the powers of these combined!
-    Mx = np.logical_and(Ml, Mc)
+    return np.stack([ Ps, Cs, aX, sX, aY, sY ], axis = -1)
 
-    if not np.any(Mx):
-        return np.nan, np.nan, np.nan, np.nan, np.nan, np.nan
+def cell_process (Rv, Ps, Cs, Fn, level, criteria, stats = False, 
+    min_count = None):
+    '''
+    Rv ... a list of squeezing rates
+    Ps ... theoretical probability of successful heralding event
+           computed for each squeezing rate
+    Cs ... counts of successful heralding events
+           computed for each squeezing rate
+    Fn ... simulated characterization frequencies
+           computed for each squeezing rate and run
+    criteria ... a list of certification criteria (level, x_mul, y_mul),
+           level None stands for the level of the target
+    min_count ... least count of heralding events for the certification,
+           DEF_CERTIFY_COUNT by default
+
+    Returns a dictionary of the named outputs, one per criterion (see
+    criterion_name), the first one named 'result'.
+
+    With stats, the per-rate sufficient statistics (see cell_statistics) are
+    returned alongside the results, allowing re-certification (see the
+    recertify module) under different criteria without resimulation.
+    '''
+
+    # The statistics are shared by the criteria of the same level.
+    with stage('reduction'):
+        S = { 
+            criterion_level : cell_statistics(Ps, Cs, Fn, 
+                level if criterion_level is None else criterion_level)
+            for criterion_level in { criterion[0] for criterion in criteria } }
+    return cell_certify(Rv, S, level, criteria, stats, min_count)
+
+def cell_certify (Rv, S, level, criteria, stats = False, min_count = None):
+    '''
+    Rv ... a list of squeezing rates
+    S  ... the per-rate sufficient statistics (see cell_statistics) of
+           each level of the criteria
 
-    Ix = Ps[Mx].argmax()
+    Certifies the cell under the criteria, see cell_process.
+    '''
+
+    min_count = DEF_CERTIFY_COUNT if min_count is None else min_count
 
-    # (@) Returns
+    # (@) Certification (threshold curve) based on (Lachman, 2019),
+    #     considers only those where Cs > min_count. Returns
     #
     # - The maximal probability of success for a squeezing rate that still
     #   passes the certification
     # - The corresponding squeezing rate
     # - The corresponding averages and standard deviations for the ensemble
 
-    return (
-        Ps[Mx][Ix], 
-        Rv[Mx][Ix],
-        aX[Mx][Ix], sX[Mx][Ix], # 2, 3
-        aY[Mx][Ix], sY[Mx][Ix]  # 4, 5
-    )
+    outputs = {}
+    with stage('certification'):
+        for index, criterion in enumerate(criteria):
+            criterion_level, x_mul, y_mul = criterion
+            curve = threshold_curve(
+                level if criterion_level is None else criterion_level)
+            outputs['result' if index == 0 else criterion_name(* criterion)] = \
+                tuple(certified_optimum(Rv, S[criterion_level], curve, 
+                    x_mul = x_mul, y_mul = y_mul, min_count = min_count))
+
+    if stats:
+        for criterion_level in S:
+            outputs[stats_name(criterion_level)] = S[criterion_level]
+    return outputs
+
+def cell_generator (seed, generator, file_name, z1, z2):
+    '''
+    Returns the random generator of a cell, given the seed of the run, 
+    the name of the bit generator, the target (its file name) and the 
+    transmission rates of the cell.
+    '''
+
+    # (@) The cell is identified as within the cache, the rates are rounded.
+    cell = hashlib.sha256(f'{file_name}:{z1:.12g}:{z2:.12g}'.encode()).digest()
+    return np.random.Generator(getattr(np.random, generator)(
+        np.random.SeedSequence(seed, 
+            spawn_key = (int.from_bytes(cell[:16], 'little'), ))))
+
+def criterion_name (level, x_mul, y_mul):
+    head = '' if level is None else f'L{level}_'
+    return f'{head}X{x_mul:g}_Y{y_mul:g}'
+
+def stats_name (level):
+    return 'stats' if level is None else f'stats_L{level}'
+
+# Sweeps. 
+#
+# The parameters of a sweep default to the respective DEF_* constants above
+# (e.g. sample_r_beg defaults to DEF_SAMPLE_R_BEG). Named sweeps overriding
+# any of them are given in a TOML file, see sweeps.toml, with a table per
+# sweep,
+#
+#   [15dB]
+#   sample_r_beg = 0.0015
+#   sample_r_end = 1.50
+#   result_path = 'result.15dB'
+#
+# Several sweeps run in one invocation share the workers and the cache.
+
+SWEEP_KEYS = [
+    'experiment_rate', 'experiment_runs', 
+    'sample_precision', 'sample_seed', 'sample_generator', 'sample_threads',
+    'task_memory',
+    'sample_r_num', 'sample_r_beg', 'sample_r_end',
+    'sample_z_num', 'sample_z_beg', 'sample_z_end',
+    'herald_capd_span', 'result_dimension', 
+    'circuit_mode', 'circuit_tolerance', 'circuit_plan',
+    'detector_pnrd', 'detector_capd_click', 'detector_capd_width',
+    'certify_criteria', 'certify_count',
+    'result_format', 'result_tile', 'result_stats', 'result_stats_tile',
+    'result_path' ]
+
+class Sweep:
+    def __init__ (self, name = 'default', ** params):
+        unknown = set(params) - set(SWEEP_KEYS)
+        if unknown:
+            raise ValueError(f'Unknown parameters {sorted(unknown)} of sweep {name}')
+
+        self.name = name
+        for key in SWEEP_KEYS:
+            setattr(self, key, params.get(key, globals()[f'DEF_{key.upper()}']))
+        self.certify_criteria = make_criteria(self.certify_criteria)
+        # (@) The statistics do not fit a single array in memory, they are
+        #     only supported by the tile stores.
+        if self.result_stats:
+            self.result_format = 'tiles'
+
+    def __repr__ (self):
+        return f'Sweep({self.name!r})'
+
+    @property
+    def rspace (self):
+        return np.linspace(self.sample_r_beg, self.sample_r_end, self.sample_r_num)
+
+    @property
+    def zspace (self):
+        return np.linspace(self.sample_z_beg, self.sample_z_end, self.sample_z_num)
+
+def make_criteria (criteria):
+    # TOML has no None, criteria (x_mul, y_mul) stand for (None, x_mul, y_mul).
+    return [ tuple(criterion) if len(criterion) == 3 else (None, * criterion)
+        for criterion in criteria ]
+
+def load_sweeps (path, names = None):
+    '''
+    Reads the named sweeps from a TOML file, all of them unless names are
+    given.
+    '''
+
+    with open(path, 'rb') as file:
+        config = tomllib.load(file)
+    for name in (names or []):
+        if name not in config:
+            raise KeyError(f'Unknown sweep {name} in {path}')
+    return [ Sweep(name, ** config[name]) for name in (names or config) ]
 
 # Individual simulation workflows wrapped into callable functions.
+# The stages are timed (see helpers.stage), the timing of every target is
+# reported next to its results. Retried cells (attempt > 0) are sampled in
+# smaller blocks. In the adaptive circuit mode, the circuits also return
+# their truncation error (see circuit.evaluate_circuit_adaptive).
 #
 
-def task_worker_target_pnrd_pnrd (Rv, z1, z2, m):
-    Ps, Pn = evaluate_circuit_pnrd_pnrd(Rv, z1, z2, m, 
-        d = DEF_RESULT_DIMENSION)
-    Cs, Fn = cell_sampler(Ps, Pn)
-    return cell_process(Rv, Ps, Cs, Fn, m)
+def task_worker_target_pnrd_pnrd (sweep, Rv, z1, z2, m, attempt = 0):
+    d, tail, tol = circuit_dimension(sweep, m)
+    W = task_workspace(sweep)
+    with stage('circuit'):
+        Ps, Pn, * error = evaluate_circuit_pnrd_pnrd(Rv, z1, z2, m, d, tail, 
+            tol = tol,
+            out = W.buffer('result', d + tail),
+            workspace = W)
+    S = task_sample(sweep, Ps, Pn, m, 
+        task_generator(sweep, m, None, z1, z2), attempt)
+    return task_outputs(cell_certify(Rv, S, m, sweep.certify_criteria, 
+        sweep.result_stats, sweep.certify_count), Pn, error)
+
+def task_worker_target_capd_pnrd (sweep, Rv, z1, z2, m, M, attempt = 0):
+    d, tail, tol = circuit_dimension(sweep, m)
+    W = task_workspace(sweep)
+    with stage('capd_weights'):
+        Wk = task_capd_weights(m, M, sweep.herald_capd_span)
+    with stage('circuit'):
+        Ps, Pn, * error = evaluate_circuit_capd_pnrd(Rv, z1, z2, m, M, 
+            K = sweep.herald_capd_span,
+            d = d,
+            weights = Wk,
+            tail = tail,
+            tol = tol,
+            out = W.buffer('result', d + tail),
+            workspace = W)
+    S = task_sample(sweep, Ps, Pn, m, 
+        task_generator(sweep, m, M, z1, z2), attempt)
+    return task_outputs(cell_certify(Rv, S, m, sweep.certify_criteria, 
+        sweep.result_stats, sweep.certify_count), Pn, error)
+
+# (@) All the targets of a cell at once, from the circuit terms computed once
+#     for the largest dimension any of the targets needs. Each target then
+#     takes its leading coefficients, the tail, and is sampled on its own.
+
+def task_worker_cell (sweep, Rv, z1, z2, attempt = 0):
+    W = task_workspace(sweep)
+    targets = cell_targets(sweep)
+    d = max(circuit_dimension(sweep, m)[0] for file_name, m, M in targets)
+    capd_list = [ (m, M) for file_name, m, M in targets if M is not None ]
+    with stage('capd_weights'):
+        Wk = { (m, M) : task_capd_weights(m, M, sweep.herald_capd_span) 
+            for m, M in capd_list }
+    with stage('circuit'):
+        pnrd, capd = evaluate_circuit_shared(Rv, z1, z2, d, 
+            sweep.detector_pnrd, capd_list, 
+            K = sweep.herald_capd_span,
+            weights = Wk,
+            workspace = W)
+
+    outputs = {}
+    for file_name, m, M in targets:
+        Ps, Pn = pnrd[m] if M is None else capd[m, M]
+        d, tail, _ = circuit_dimension(sweep, m)
+        Pn = append_tail(Pn[..., :d], out = W.buffer('result', d + 1)) \
+            if tail else Pn
+        S = task_sample(sweep, Ps, Pn, m, 
+            task_generator(sweep, m, M, z1, z2), attempt)
+        for output_name, output in cell_certify(Rv, S, m, 
+            sweep.certify_criteria, sweep.result_stats, sweep.certify_count).items():
+            outputs[file_name, output_name] = output
+    return outputs
+
+def cell_targets (sweep):
+    # The targets (file_name, m, M) of a cell, M is None for the PNRD ones.
+    return [ (target_file_name(m, None), m, None)
+            for m in sweep.detector_pnrd ] \
+        + [ (target_file_name(m, M), m, M)
+            for m, M in it.product(
+                sweep.detector_capd_click, 
+                sweep.detector_capd_width) ]
+
+def target_file_name (m, M):
+    if M is None:
+        return make_file_name('pnrd_pnrd', '{:02}', (m, ))
+    return make_file_name('capd_pnrd', '{:02}_{:02}', (m, M))
+
+def task_generator (sweep, m, M, z1, z2):
+    # (@) The same stream for the target in both circuit plans.
+    return cell_generator(sweep.sample_seed, sweep.sample_generator, 
+        target_file_name(m, M), z1, z2)
+
+# (@) The squeezing rates are sampled and reduced in chunks, the runs in 
+#     blocks, fitting the memory budget of the sweep (see sample_plan). The 
+#     streams of the rates continue from one chunk to the next, neither the
+#     chunks nor the blocks change the statistics.
+
+def task_sample (sweep, Ps, Pn, level, rng, attempt = 0):
+    chunk, blocks = sample_plan(sweep, Ps.size, Pn.shape[-1], attempt)
+    S = { criterion[0] : np.empty((Ps.size, 6)) 
+        for criterion in sweep.certify_criteria }
+    for offset in range(0, Ps.size, chunk):
+        rates = slice(offset, offset + chunk)
+        with stage('sampling'):
+            Cs, Fn = cell_sampler(Ps[rates], Pn[rates], 
+                rate = sweep.experiment_rate, runs = sweep.experiment_runs,
+                blocks = blocks, precision = sweep.sample_precision,
+                threads = sweep.sample_threads,
+                rng = rng)
+        with stage('reduction'):
+            for criterion_level in S:
+                S[criterion_level][rates] = cell_statistics(Ps[rates], Cs, Fn,
+                    level if criterion_level is None else criterion_level)
+        del Cs, Fn
+    return S
+
+def sample_plan (sweep, size, d, attempt = 0):
+    '''
+    Returns the number of the squeezing rates sampled at once (a multiple of
+    SAMPLE_RATE_BLOCK) and the number of blocks of the runs, so that the 
+    sampling of a cell of the given size and dimension fits the memory 
+    budget of the sweep. Retried cells (attempt > 0) split the runs into
+    more blocks. A single block of rates is sampled at once even if it does
+    not fit the budget.
+    '''
+
+    runs = sweep.experiment_runs
+    blocks = min(4 ** attempt, runs)
+    if sweep.task_memory is None:
+        return size, blocks
+
+    # Frequencies and the statistics (float64 temporaries of the moments)
+    # of each rate, events of each block of rates and runs, of each thread.
+    itemsize = np.dtype(sample_types(sweep.sample_precision)[1]).itemsize
+    rate_bytes = runs * ((d + 1) * itemsize + 16)
+    event_bytes = lambda blocks: sweep.sample_threads * SAMPLE_RATE_BLOCK \
+        * (- (- runs // blocks)) * d * 8
+
+    # (@) More blocks of the runs only help while the rates fit.
+    least = SAMPLE_RATE_BLOCK * rate_bytes
+    while (blocks < runs) and (least < sweep.task_memory < least + event_bytes(blocks)):
+        blocks = min(2 * blocks, runs)
+    chunk = SAMPLE_RATE_BLOCK * max(1, 
+        (sweep.task_memory - event_bytes(blocks)) // (SAMPLE_RATE_BLOCK * rate_bytes))
+    return min(chunk, size), blocks
 
-def task_worker_target_capd_pnrd (Rv, z1, z2, m, M):
-    Ps, Pn = evaluate_circuit_capd_pnrd(Rv, z1, z2, m, M, 
-        K = DEF_HERALD_CAPD_SPAN,
-        d = DEF_RESULT_DIMENSION)
-    Cs, Fn = cell_sampler(Ps, Pn)
-    return cell_process(Rv, Ps, Cs, Fn, m)
+def task_outputs (outputs, Pn, error):
+    # The dimension and the largest truncation error of the adaptive mode.
+    if error:
+        outputs['truncation'] = (Pn.shape[-1], np.max(error))
+    return outputs
+
+def circuit_dimension (sweep, level):
+    # The tail mode needs the coefficients up to the highest certified level,
+    # the adaptive one starts with one more (see evaluate_circuit_adaptive).
+    highest = max([ level ] + [ criterion[0] 
+        for criterion in sweep.certify_criteria 
+        if criterion[0] is not None ])
+    if sweep.circuit_mode == 'tail':
+        return 1 + highest, True, None
+    if sweep.circuit_mode == 'full':
+        return sweep.result_dimension, False, None
+    if sweep.circuit_mode == 'adaptive':
+        return 2 + highest, False, sweep.circuit_tolerance
+    raise ValueError(f'Unknown circuit mode {sweep.circuit_mode}')
+
+# (@) The weights only depend on the detector, each worker computes them once.
+task_capd_weights = ft.lru_cache(detector_capd_weights)
+
+# (@) The quantities depending only on the squeezing rates and the buffers of
+#     the circuits are kept by each worker for the cells of the same sweep,
+#     the circuits then allocate no arrays of the size of their results.
+def task_workspace (sweep):
+    return _task_workspace(sweep.sample_r_beg, sweep.sample_r_end, 
+        sweep.sample_r_num)
+
+@ft.lru_cache(maxsize = 4)
+def _task_workspace (r_beg, r_end, r_num):
+    return CircuitWorkspace(np.linspace(r_beg, r_end, r_num))
 
 # Dispatch simulation workflows and process the results.
+# Each target is described by the arguments of the dispatcher (see helpers),
+# shared by the actual sweep and its cost estimate.
 #
 
-def master_target_pnrd_pnrd (rspace, zspace, pool):
-    master_target_dispatcher(zspace, pool,
-        worker = taskwrap(task_worker_target_pnrd_pnrd, rspace),
+def make_targets (sweep):
+    if sweep.circuit_plan == 'shared' and sweep.circuit_mode != 'adaptive':
+        return [ make_target_cells(sweep) ]
+    if sweep.circuit_plan in [ 'shared', 'separate' ]:
+        return [ make_target_pnrd_pnrd(sweep), make_target_capd_pnrd(sweep) ]
+    raise ValueError(f'Unknown circuit plan {sweep.circuit_plan}')
+
+def make_target_cells (sweep):
+    return dict(
+        worker = taskwrap(task_worker_cell, sweep, sweep.rspace),
+        target_name = 'cells',
+        target_name_tail = '',
+        target_tail_list = [ () ],
+        result_format = sweep.result_format,
+        result_outputs = { 
+            (file_name, output_name) : output
+            for file_name, m, M in cell_targets(sweep)
+            for output_name, output in make_result_outputs(sweep).items() },
+        cache_params = make_cache_params(sweep, 
+            herald_capd_span = sweep.herald_capd_span,
+            targets = cell_targets(sweep)),
+        result_path = sweep.result_path)
+
+def make_target_pnrd_pnrd (sweep):
+    return dict(
+        worker = taskwrap(task_worker_target_pnrd_pnrd, sweep, sweep.rspace),
         target_name = 'pnrd_pnrd',
         target_name_tail = '{:02}',
-        target_tail_list = DEF_DETECTOR_PNRD)
+        target_tail_list = sweep.detector_pnrd,
+        result_format = sweep.result_format,
+        result_outputs = make_result_outputs(sweep),
+        cache_params = make_cache_params(sweep),
+        result_path = sweep.result_path)
 
-def master_target_capd_pnrd (rspace, zspace, pool):
-    master_target_dispatcher(zspace, pool,
-        worker = taskwrap(task_worker_target_capd_pnrd, rspace),
+def make_target_capd_pnrd (sweep):
+    return dict(
+        worker = taskwrap(task_worker_target_capd_pnrd, sweep, sweep.rspace),
         target_name = 'capd_pnrd',
         target_name_tail = '{:02}_{:02}',
-        target_tail_list = it.product(
-            DEF_DETECTOR_CAPD_CLICK, 
-            DEF_DETECTOR_CAPD_WIDTH))
+        target_tail_list = list(it.product(
+            sweep.detector_capd_click, 
+            sweep.detector_capd_width)),
+        result_format = sweep.result_format,
+        result_outputs = make_result_outputs(sweep),
+        cache_params = make_cache_params(sweep, 
+            herald_capd_span = sweep.herald_capd_span),
+        result_path = sweep.result_path)
+
+# The result of each cell, optionally accompanied by the per-rate statistics.
+# Outputs are named, with their cell shape and tile size (see dispatcher).
+
+def make_result_outputs (sweep):
+    outputs = { 'result' : ((6, ), sweep.result_tile) }
+    for criterion in sweep.certify_criteria[1:]:
+        outputs[criterion_name(* criterion)] = ((6, ), sweep.result_tile)
+    if sweep.circuit_mode == 'adaptive':
+        outputs['truncation'] = ((2, ), sweep.result_tile)
+    if sweep.result_stats:
+        for criterion in sweep.certify_criteria:
+            outputs[stats_name(criterion[0])] = \
+                ((sweep.sample_r_num, 6), sweep.result_stats_tile)
+    return outputs
+
+# Everything the cells depend on, besides the transmission rates and the
+# detector configuration (added by the dispatcher), is listed here.
+
+def make_cache_params (sweep, ** extra):
+    return {
+        'rspace' : sweep.rspace,
+        'experiment_rate' : sweep.experiment_rate,
+        'experiment_runs' : sweep.experiment_runs,
+        'sample_precision' : sweep.sample_precision,
+        'sample_seed' : sweep.sample_seed,
+        'sample_generator' : sweep.sample_generator,
+        'sample_rate_block' : SAMPLE_RATE_BLOCK,
+        'result_dimension' : sweep.result_dimension,
+        'circuit_mode' : sweep.circuit_mode,
+        'circuit_tolerance' : sweep.circuit_tolerance,
+        'result_stats' : sweep.result_stats,
+        'certify_criteria' : sweep.certify_criteria,
+        'certify_count' : sweep.certify_count,
+        ** extra
+    }
+
+# The code the cells depend on, the streams of the cells included (see
+# task_generator). The constants are listed among the parameters.
+CACHE_CODE = [
+    circuit, certify, stellar, 
+    cell_sampler, cell_statistics, cell_process, cell_certify, cell_generator,
+    task_sample, task_generator, target_file_name,
+    task_worker_target_pnrd_pnrd,
+    task_worker_target_capd_pnrd,
+    task_worker_cell ]
+
+def make_cache (shard = None):
+    # (@) Each shard keeps its own cache, the shards share no file.
+    if DEF_RESULT_CACHE is None:
+        return None
+    path = DEF_RESULT_CACHE
+    if shard is not None:
+        root, ext = os.path.splitext(path)
+        path = f'{root}.{SHARD_PATTERN.format(* shard)}{ext}'
+    return ResultCache(path, code = CACHE_CODE)
 
 # Dispatcher. 
 #
 # Uses mpi4py.futures instead of concurrent.futures. Some versions of the
 # latter library, in conjuction with some versions of numpy, resulted in
-# deadlocks and performance issues.
+# deadlocks and performance issues. The local and serial pools (see helpers)
+# serve small runs without MPI.
 #
 
-def master ():
-    rspace = np.linspace(DEF_SAMPLE_R_BEG, DEF_SAMPLE_R_END, DEF_SAMPLE_R_NUM)
-    zspace = np.linspace(DEF_SAMPLE_Z_BEG, DEF_SAMPLE_Z_END, DEF_SAMPLE_Z_NUM)
-    zstd_pickle_dump('result/rspace.pickle.zstd', rspace)
-    zstd_pickle_dump('result/zspace.pickle.zstd', zspace)
+def make_pool ():
+    if DEF_EXECUTOR == 'mpi':
+        # (@) Imported here, the kernels above can be used without MPI.
+        import mpi4py.futures
+        return mpi4py.futures.MPIPoolExecutor()
+    if DEF_EXECUTOR == 'local':
+        return LocalPool(DEF_EXECUTOR_WORKERS)
+    if DEF_EXECUTOR == 'serial':
+        return SerialPool()
+    raise ValueError(f'Unknown executor {DEF_EXECUTOR}')
 
-    with mpi4py.futures.MPIPoolExecutor() as pool:
-        master_target_pnrd_pnrd(rspace, zspace, pool)
-        master_target_capd_pnrd(rspace, zspace, pool)
+def master (sweeps = None, shard = None):
+    '''
+    Runs the sweeps. With a shard (index, count), only the part of the grid
+    belonging to the shard is computed and stored as tile stores within
+    the shard directory (see mergeshards module) of each sweep.
+    '''
+
+    sweeps = sweeps or [ Sweep() ]
+    if shard is not None:
+        sweeps = [ make_shard_sweep(sweep, * shard) for sweep in sweeps ]
+    cache = make_cache(shard)
+
+    with make_pool() as pool:
+        for sweep in sweeps:
+            print(f'Sweep {sweep.name} into {sweep.result_path}')
+            os.makedirs(sweep.result_path, exist_ok = True)
+            zstd_pickle_dump(f'{sweep.result_path}/rspace.pickle.zstd', sweep.rspace)
+            zstd_pickle_dump(f'{sweep.result_path}/zspace.pickle.zstd', sweep.zspace)
+
+            model = CostModel.load(f'{sweep.result_path}/{DEF_COST_MODEL}')
+            for target in make_targets(sweep):
+                master_target_dispatcher(sweep.zspace, pool, ** target, 
+                    cache = cache, model = model, shard = shard,
+                    task_retries = DEF_TASK_RETRIES,
+                    task_timeout = DEF_TASK_TIMEOUT)
+                model.save(f'{sweep.result_path}/{DEF_COST_MODEL}')
+
+    if cache is not None:
+        cache.close()
+
+def make_shard_sweep (sweep, index, count):
+    # Partial results are only supported by the tile stores.
+    params = { key : getattr(sweep, key) for key in SWEEP_KEYS }
+    params['result_format'] = 'tiles'
+    params['result_path'] = shard_path(sweep.result_path, index, count)
+    return Sweep(sweep.name, ** params)
+
+def master_estimate (ranks, cells, sweeps = None):
+    '''
+    Dry run. Computes a few cells of each target, prints the expected CPU
+    and wall time of the sweeps with the given number of ranks and stores
+    the measured costs (see helpers.CostModel) for the actual sweeps.
+    '''
+
+    sweeps = sweeps or [ Sweep() ]
+    with make_pool() as pool:
+        for sweep in sweeps:
+            model = CostModel()
+            target_cells = {}
+            for target in make_targets(sweep):
+                target_cells.update(master_target_estimator(sweep.zspace, pool, 
+                    ** target, model = model, cells = cells))
+
+            print(f'Sweep {sweep.name}')
+            print(model.report(target_cells, ranks))
+            os.makedirs(sweep.result_path, exist_ok = True)
+            model.save(f'{sweep.result_path}/{DEF_COST_MODEL}')
 
 if (__name__ == '__main__'):
-    master()
+    parser = argparse.ArgumentParser(description = 'Runs the simulation.')
+    parser.add_argument('sweeps', nargs = '*', metavar = 'SWEEP',
+        help = 'names of the sweeps to run, all of the config file by default')
+    parser.add_argument('--config', 
+        help = 'TOML file with the named sweeps (see sweeps.toml), '
+            'without it a single sweep given by DEF_* constants runs')
+    parser.add_argument('--estimate', type = int, metavar = 'RANKS',
+        help = 'estimate the cost of the sweeps with RANKS ranks and exit')
+    parser.add_argument('--estimate-cells', type = int, default = 3,
+        help = 'cells sampled from each target by the estimate')
+    parser.add_argument('--shard', type = parse_shard, metavar = 'I/N',
+        help = 'only compute the I-th of N shards of the grid (from zero), '
+            'merge the shards with mergeshards.py')
+    args = parser.parse_args()
+
+    if args.config:
+        sweeps = load_sweeps(args.config, args.sweeps)
+    elif args.sweeps:
+        parser.error('named sweeps require --config')
+    else:
+        sweeps = [ Sweep() ]
 
+    if args.estimate:
+        master_estimate(args.estimate, args.estimate_cells, sweeps)
+    else:
+        master(sweeps, args.shard)